@@ -0,0 +1,438 @@
+import ast
+import hashlib
+import io
+import multiprocessing
+import os
+import tarfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from metrics import ComplexityCounter, block_fields, combine_metrics, compute_metrics, measure, plugin_versions
+
+# Bump whenever the per-file fragments or the merged attributes change shape or meaning,
+# so stale cached analyses are not served.
+ANALYZER_VERSION = 8
+
+# Commits with fewer uncached files than this are parsed in the calling thread, where
+# handing files to the pool would cost more than it saves
+PARALLEL_MIN_FILES = int(os.environ.get("CODEBLUEPRINT_PARALLEL_MIN_FILES", 64))
+# Processes in the parse pool; 0 means one per core, 1 turns the pool off
+PARSE_WORKERS = int(os.environ.get("CODEBLUEPRINT_PARSE_WORKERS", 0)) or os.cpu_count() or 1
+
+_parse_pool = None
+_parse_pool_pid = None
+_parse_pool_lock = threading.Lock()
+
+
+# Same id git gives the file contents, so fragments can be looked up straight from a tree listing
+def blob_sha(data):
+    header = f"blob {len(data)}\0".encode("ascii")
+    return hashlib.sha1(header + data).hexdigest()
+
+
+# Dotted name written for a base class: "CookieJar", "cookielib.CookieJar", or "Generic"
+# for Generic[T]; None for anything computed
+def _dotted_name(node):
+    if isinstance(node, ast.Subscript):
+        node = node.value
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+# Collects every per-file metric in one traversal. Methods and attributes are the
+# statements directly in a class body; loops count anywhere inside the class, methods
+# included, but loops inside a nested class belong to that class. Functions are those
+# defined at module level, outside any class or function. Each method and function also
+# gets [cyclomatic complexity, statement count, max nesting depth]. Complexity is counted
+# by ComplexityCounter in this same pass, which also scores every other function and
+# lambda for the cyclomatic_complexity plugin; nested functions are left out of the one
+# they are in. Statements and depth take in nested functions but not classes; depth is
+# how many compound statements (or nested defs) enclose the deepest statement, so a flat
+# body is 0. Imports outside classes and functions are kept as
+# [bound name, level, module, imported name] (imported name None for "import a.b") for
+# resolving base classes across files.
+class ProjectVisitor(ComplexityCounter):
+    def __init__(self, text=None):
+        super().__init__(text)
+        self.classes = []
+        self.functions = []
+        self.function_metrics = []
+        self.imports = []
+        self._class_stack = []
+        self._in_class_body = False
+        self._method = None
+        self._method_node = None
+        self._depth = 0
+
+    def visit_ClassDef(self, node):
+        qualified_name = ".".join([c["name"] for c in self._class_stack] + [node.name])
+        bases = [_dotted_name(base) for base in node.bases]
+        current_class = {"name": qualified_name, "bases": [base for base in bases if base], "methods": [],
+                         "method_metrics": [], "attributes": [], "loops": 0}
+        self.classes.append(current_class)
+        self._visit_scope(node, current_class, True, None)
+
+    def visit_FunctionDef(self, node):
+        method = None
+        if self._in_class_body:
+            method = [1, 0, 0]
+            self._class_stack[-1]["methods"].append(node.name)
+            self._class_stack[-1]["method_metrics"].append(method)
+        elif not self._class_stack and self._method is None:
+            method = [1, 0, 0]
+            self.functions.append(node.name)
+            self.function_metrics.append(method)
+        self._open_function(node)
+        self._visit_scope(node, None, False, method)
+        complexity = self._close_function()
+        if method is not None:
+            method[0] = complexity
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Import(self, node):
+        if not self._class_stack and self._method is None:
+            for alias in node.names:
+                if alias.asname:
+                    self.imports.append([alias.asname, 0, alias.name, None])
+                else:
+                    # "import a.b" binds a
+                    self.imports.append([alias.name.split(".")[0], 0, alias.name.split(".")[0], None])
+
+    def visit_ImportFrom(self, node):
+        if not self._class_stack and self._method is None:
+            for alias in node.names:
+                self.imports.append([alias.asname or alias.name, node.level, node.module or "", alias.name])
+
+    def visit_Assign(self, node):
+        if self._in_class_body:
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    self._class_stack[-1]["attributes"].append(target.id)
+
+    def visit_AnnAssign(self, node):
+        if self._in_class_body and isinstance(node.target, ast.Name):
+            self._class_stack[-1]["attributes"].append(node.target.id)
+
+    def visit_For(self, node):
+        if self._class_stack:
+            self._class_stack[-1]["loops"] += 1
+        self.generic_visit(node)
+
+    visit_AsyncFor = visit_For
+
+    # Classes, functions, assignments and loops are all statements, so only the statement
+    # lists need walking; expressions are only walked on lines that could hold a decision
+    # (see ComplexityCounter), and skipping the rest is most of the win over ast.walk.
+    # Inside a method, each compound statement puts its children one level deeper.
+    def generic_visit(self, node):
+        method = self._method
+        deeper = method is not None and isinstance(node, ast.stmt) and node is not self._method_node
+        if deeper:
+            self._depth += 1
+        for field in block_fields(type(node)):
+            children = getattr(node, field)
+            # An elif is an If alone in orelse; it stays at the level of its if
+            elif_chain = deeper and field == "orelse" and len(children) == 1 and isinstance(children[0], ast.If)
+            if elif_chain:
+                self._depth -= 1
+            for child in children:
+                if method is not None and isinstance(child, ast.stmt):
+                    method[1] += 1
+                    if self._depth > method[2]:
+                        method[2] = self._depth
+                self._count(child)
+                self.visit(child)
+            if elif_chain:
+                self._depth += 1
+        if deeper:
+            self._depth -= 1
+
+    def _visit_scope(self, node, current_class, in_class_body, method):
+        outer = self._in_class_body, self._method, self._method_node, self._depth
+        if current_class is not None:
+            self._class_stack.append(current_class)
+        self._in_class_body = in_class_body
+        # Class bodies never count toward an enclosing method; nested functions do
+        if current_class is not None or method is not None:
+            self._method, self._method_node, self._depth = method, node, 0
+        self.generic_visit(node)
+        self._in_class_body, self._method, self._method_node, self._depth = outer
+        if current_class is not None:
+            self._class_stack.pop()
+
+
+# Analyze one file's source into a self-contained fragment that can be cached per blob
+def analyze_source(data):
+    return analyze_file(data, ())[0]
+
+
+# The file's fragment plus {name: value} for the named metric plugins, which reuse the
+# syntax tree parsed for the fragment
+def analyze_file(data, metric_names):
+    text = data.decode("utf-8", errors="replace") if isinstance(data, bytes) else data
+    code_lines = io.StringIO(text, newline=None).readlines()
+    source = "".join(code_lines)
+    fragment = {"lines_of_code": len(code_lines), "classes": [], "functions": [], "function_metrics": [],
+                "imports": [], "syntax_error": False}
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        fragment["syntax_error"] = True
+        tree = None
+    if tree is not None:
+        visitor = ProjectVisitor(source)
+        visitor.visit(tree)
+        fragment["classes"] = visitor.classes
+        fragment["functions"] = visitor.functions
+        fragment["function_metrics"] = visitor.function_metrics
+        fragment["imports"] = visitor.imports
+    complexities = visitor.complexities if tree is not None else None
+    metrics = compute_metrics(text, metric_names, tree, complexities) if metric_names else {}
+    return fragment, metrics
+
+
+def _get_parse_pool():
+    global _parse_pool, _parse_pool_pid
+    with _parse_pool_lock:
+        # A pool inherited through fork belongs to the parent
+        if _parse_pool is None or _parse_pool_pid != os.getpid():
+            # forkserver, so the pool never forks a copy of a multi-threaded web worker
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=context)
+            _parse_pool_pid = os.getpid()
+        return _parse_pool
+
+
+def _map(fn, *iterables, size):
+    if size < PARALLEL_MIN_FILES or PARSE_WORKERS <= 1:
+        return map(fn, *iterables)
+    chunksize = max(1, size // (PARSE_WORKERS * 4))
+    return _get_parse_pool().map(fn, *iterables, chunksize=chunksize)
+
+
+# Analyze {sha: bytes} into ({sha: fragment}, {sha: metric values}), fanning out over the
+# shared process pool when there are enough files. Fragments are plain dicts, so they
+# pickle back cheaply. on_fragment(sha, fragment) is called as each file finishes.
+def analyze_sources(blobs, on_fragment=None, metric_names=()):
+    shas = sorted(blobs)
+    results = {}
+    metrics = {}
+    analyzed = _map(analyze_file, [blobs[sha] for sha in shas], repeat(metric_names), size=len(shas))
+    for sha, (fragment, values) in zip(shas, analyzed):
+        results[sha] = fragment
+        metrics[sha] = values
+        if on_fragment:
+            on_fragment(sha, fragment)
+    return results, metrics
+
+
+# Compute only the named metrics for files whose fragments are already cached:
+# {sha: (bytes, names)} -> {sha: {name: value}}
+def measure_sources(jobs):
+    shas = sorted(jobs)
+    return dict(zip(shas, _map(measure, [jobs[sha] for sha in shas], size=len(shas))))
+
+
+# d3 leaf for a method or module-level function, weighted by what it costs to read
+def method_node(name, metrics, kind="method"):
+    complexity, statements, depth = metrics
+    return {"name": name, "type": kind, "complexity": complexity, "statements": statements, "depth": depth}
+
+
+# Dotted module name of a file path: "requests/sessions.py" -> "requests.sessions", and a
+# package's __init__.py stands for the package itself
+def module_name(path):
+    parts = path[:-3].split("/") if path.endswith(".py") else path.split("/")
+    if len(parts) > 1 and parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+# Running totals of an analysis in progress, reported to progress(event, data) after each
+# batch of files: how many files and bytes are done, the class and method counts so far,
+# and the classes just found as d3 nodes
+class _Progress:
+    def __init__(self, progress, entries):
+        self.progress = progress
+        self.paths = {}
+        for path, sha in entries:
+            self.paths.setdefault(sha, []).append(path)
+        self.files_total = len(entries)
+        self.files_done = 0
+        self.bytes_parsed = 0
+        self.num_classes = 0
+        self.num_methods = 0
+
+    def start(self, cached_files):
+        self.progress("start", {"files_total": self.files_total, "files_cached": cached_files})
+
+    def report(self, fragments, sizes=None):
+        classes = []
+        for sha, fragment in fragments.items():
+            copies = len(self.paths.get(sha, ())) or 1
+            self.files_done += copies
+            self.bytes_parsed += (sizes or {}).get(sha, 0)
+            for class_info in fragment["classes"]:
+                self.num_classes += copies
+                self.num_methods += copies * len(class_info["methods"])
+                classes.append({
+                    "name": class_info["name"],
+                    "children": [method_node(method, metrics)
+                                 for method, metrics in zip(class_info["methods"], class_info["method_metrics"])]
+                    + [{"name": attribute, "type": "attribute"} for attribute in class_info["attributes"]],
+                })
+        self.progress("progress", {
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "bytes_parsed": self.bytes_parsed,
+            "num_classes": self.num_classes,
+            "num_methods": self.num_methods,
+        })
+        if classes:
+            self.progress("classes", classes)
+
+
+# Assemble a commit's totals, modules and classes from per-file fragments, in path order.
+# Modules are keyed by dotted module name and classes by module name plus their (possibly
+# nested) class name, so same-named classes in different files are all kept.
+def merge_fragments(fragments):
+    class_attributes = {
+        "lines_of_code": 0,
+        "num_classes": 0,
+        "num_methods": 0,
+        "num_variables": 0,
+        "for_loops": 0,
+        "modules": {},
+        "classes": {}
+    }
+    for path, fragment in fragments:
+        class_attributes["lines_of_code"] += fragment["lines_of_code"]
+        if fragment["syntax_error"]:
+            print(f"Error parsing {path}. Skipping.")
+            continue
+        module = module_name(path)
+        current_module = class_attributes["modules"].setdefault(module, {
+            "package": False,
+            "functions": [],
+            "function_metrics": [],
+        })
+        current_module["package"] = current_module["package"] or path.endswith("/__init__.py")
+        current_module["functions"].extend(fragment["functions"])
+        current_module["function_metrics"].extend(list(metrics) for metrics in fragment["function_metrics"])
+        for class_info in fragment["classes"]:
+            current_class = {
+                "module": module,
+                "name": class_info["name"],
+                "bases": list(class_info["bases"]),
+                "methods": list(class_info["methods"]),
+                "method_metrics": [list(metrics) for metrics in class_info["method_metrics"]],
+                "attributes": list(class_info["attributes"]),
+                "loops": class_info["loops"],
+            }
+            class_attributes["num_classes"] += 1
+            class_attributes["num_methods"] += len(current_class["methods"])
+            class_attributes["num_variables"] += len(current_class["attributes"])
+            class_attributes["for_loops"] += current_class["loops"]
+            # A class defined twice in one module (e.g. under if/else) is shown once
+            class_attributes["classes"].setdefault(module + "." + class_info["name"], current_class)
+    return class_attributes
+
+
+# Metric plugins each of the cached files still lacks: {sha: [name, ...]}
+def _unmeasured(shas, measured):
+    versions = plugin_versions()
+    unmeasured = {}
+    for sha in dict.fromkeys(shas):
+        names = [name for name in versions if name not in measured.get(sha, {})]
+        if names:
+            unmeasured[sha] = names
+    return unmeasured
+
+
+# Look up cached fragments for (path, blob sha) entries and only analyze the misses.
+# read_blobs(shas) returns {sha: bytes} and is only called for shas not already cached,
+# so callers that already know the blob shas never read unchanged files. Metric plugin
+# values are cached apart, so a newly added plugin only reads and measures files for
+# itself. progress, if given, is called as progress(event, data) while the analysis runs.
+def analyze_blobs(entries, read_blobs, fragment_cache=None, progress=None, metric_cache=None):
+    entries = sorted(entries)
+    shas = [sha for _, sha in entries]
+    versions = plugin_versions()
+    cached = fragment_cache.get_many(shas, ANALYZER_VERSION) if fragment_cache else {}
+    measured = metric_cache.get_many(shas, versions.items()) if metric_cache else {}
+    missing = [sha for sha in shas if sha not in cached]
+    unmeasured = _unmeasured([sha for sha in shas if sha in cached], measured)
+    blobs = read_blobs(missing + list(unmeasured))
+    on_fragment = None
+    if progress:
+        tracker = _Progress(progress, entries)
+        tracker.start(len(entries) - len(missing))
+        if cached:
+            tracker.report(cached)
+        on_fragment = lambda sha, fragment: tracker.report({sha: fragment}, {sha: len(blobs[sha])})
+    fresh, new_metrics = analyze_sources({sha: blobs[sha] for sha in missing}, on_fragment, list(versions))
+    new_metrics.update(measure_sources({sha: (blobs[sha], names) for sha, names in unmeasured.items()}))
+    if fragment_cache and fresh:
+        fragment_cache.put_many(fresh, ANALYZER_VERSION)
+    if metric_cache and new_metrics:
+        metric_cache.put_many(new_metrics, versions)
+    for sha, values in new_metrics.items():
+        measured.setdefault(sha, {}).update(values)
+    fragments = [(path, cached.get(sha) or fresh[sha]) for path, sha in entries]
+    attributes = merge_fragments(fragments)
+    attributes["metrics"] = combine_metrics([measured.get(sha, {}) for sha in shas])
+    return attributes
+
+
+def extract_project_attributes(project_directory, repo_owner, repo_name, fragment_cache=None, progress=None,
+                               metric_cache=None):
+    entries = []
+    contents = {}
+    for root, dirs, files in os.walk(project_directory):
+        dirs.sort()
+        for filename in files:
+            if filename.endswith(".py"):
+                file_path = os.path.join(root, filename)
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                sha = blob_sha(data)
+                contents[sha] = data
+                entries.append((os.path.relpath(file_path, project_directory), sha))
+    return analyze_blobs(entries, lambda shas: {sha: contents[sha] for sha in shas}, fragment_cache, progress,
+                         metric_cache)
+
+
+# Analyze a commit straight out of a bare clone's object store
+def analyze_commit(repository, sha, fragment_cache=None, progress=None, metric_cache=None):
+    return analyze_blobs(repository.list_files(sha), repository.read_blobs, fragment_cache, progress, metric_cache)
+
+
+# Analyze a gzipped tarball read as a stream (e.g. an HTTP response body). .py members are
+# parsed straight from memory, only when their blob isn't cached; everything else is
+# skipped without being written anywhere. Paths drop the tarball's top-level directory.
+def analyze_tarball(fileobj, fragment_cache=None, progress=None, metric_cache=None):
+    entries = []
+    contents = {}
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(".py"):
+                continue
+            data = tar.extractfile(member).read()
+            sha = blob_sha(data)
+            entries.append((member.name.split("/", 1)[-1], sha))
+            # Keep the contents only of files that still need parsing or measuring
+            cached = fragment_cache is not None and fragment_cache.get_many([sha], ANALYZER_VERSION)
+            measured = metric_cache.get_many([sha], plugin_versions().items()) if metric_cache else {}
+            if not cached or _unmeasured([sha], measured):
+                contents[sha] = data
+    return analyze_blobs(entries, lambda shas: {sha: contents[sha] for sha in shas}, fragment_cache, progress,
+                         metric_cache)
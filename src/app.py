@@ -1,114 +1,138 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory, stream_with_context, url_for
 from flask_cors import CORS 
 import os
-import ast
-import requests
-import subprocess
-import tarfile
-import shutil
+import re
+from analyzer import ANALYZER_VERSION, analyze_commit, analyze_sources, analyze_tarball
+from cache import CACHE_DIR, AnalysisCache, BlobMetricCache, FragmentCache, MetricsStore, PayloadCache, PluginMetricsStore
+from commit_index import CommitIndex
+from git_backend import GitRepository
+from github_client import GitHubClient
+from hierarchy import build_tree
+from jobs import DONE, FAILED, FOREGROUND, JobQueue, QueueFull
+from metrics import plugin_versions
+from payloads import choose_encoding, encode_payload, etag_for, negotiate
+from prefetch import Prefetcher
+from progress import ProgressHub, format_event
+from registry import COMMIT_INDEX_RETRY_AFTER, RepoRegistry
+from singleflight import SingleFlight, file_lock
+from structure_diff import diff_structures
+from timeline import build_timeline
+
+# Read commits out of a local bare clone instead of downloading a tarball per request
+USE_GIT_BACKEND = os.environ.get("CODEBLUEPRINT_GIT_BACKEND", "1") != "0"
+LOCKS_DIR = os.path.join(CACHE_DIR, "locks")
+# Seconds clients and proxies may reuse a commit number -> sha resolution
+RESOLVE_MAX_AGE = int(os.environ.get("CODEBLUEPRINT_RESOLVE_MAX_AGE", 60))
+FULL_SHA = re.compile(r"[0-9a-f]{40}")
+# Longest a job status request may be held open waiting for the job to finish
+MAX_JOB_WAIT = int(os.environ.get("CODEBLUEPRINT_MAX_JOB_WAIT", 25))
+# Seconds clients are told to back off when the job queue is full
+QUEUE_FULL_RETRY_AFTER = 5
+# Seconds clients are told to wait while a repo's first commit index is built
+INDEX_BUILD_RETRY_AFTER = 2
+# Repository the original single-repo endpoints answer for when none is given
+DEFAULT_OWNER = "psf"
+DEFAULT_REPO = "requests"
+# Payload cache variant holding a commit's inheritance DAG
+INHERITANCE_VARIANT = "inheritance"
 
 app = Flask(__name__)
 CORS(app)
+analysis_cache = AnalysisCache()
+fragment_cache = FragmentCache()
+metrics_store = MetricsStore()
+blob_metric_cache = BlobMetricCache()
+plugin_metrics_store = PluginMetricsStore()
+payload_cache = PayloadCache()
+github = GitHubClient()
+analyses_in_flight = SingleFlight()
+job_queue = JobQueue()
+analysis_progress = ProgressHub()
 
-def checkout_commit(commit_hash):
-    subprocess.run(['git', 'checkout', commit_hash], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-def extract_project_attributes(project_directory, repo_owner, repo_name):
-    class_attributes = {
-        "lines_of_code": 0,
-        "num_classes": 0,
-        "num_methods": 0,
-        "num_variables": 0,
-        "for_loops": 0,
-        "classes": {}
-    }
+def build_commit_index(owner, repo):
+    repository = GitRepository.open(owner, repo) if USE_GIT_BACKEND else None
+    if repository:
+        repository.fetch()
+        return CommitIndex.build_from_git(repository)
+    return CommitIndex.build_from_api(owner, repo, github)
+
+registry = RepoRegistry(build_commit_index, caches=(analysis_cache, payload_cache))
+
+def index_job_id(owner, repo):
+    return f"{owner}/{repo}/commit-index"
 
-    # GitHub API base URL
-    BASE_URL = 'https://api.github.com'
-
-    for root, _, files in os.walk(project_directory):
-        for filename in files:
-            if filename.endswith(".py"):
-                file_path = os.path.join(root, filename)
-                with open(file_path, "r") as f:
-                    try:
-                        code_lines = f.readlines()
-                        class_attributes["lines_of_code"] += len(code_lines)
-
-                        tree = ast.parse("".join(code_lines))
-                        for node in ast.walk(tree):
-                            if isinstance(node, ast.ClassDef):
-                                class_name = node.name
-                                class_attributes["num_classes"] += 1
-
-                                current_class = {"methods": [], "attributes": [], "loops": 0}  # Add loops attribute to current_class
-                                parent_classes = []
-                                for base_class in node.bases:
-                                    if isinstance(base_class, ast.Name):
-                                        parent_classes.append(base_class.id)
-
-                                if parent_classes:
-                                    class_attributes["classes"].setdefault(parent_classes[0], {}).setdefault(class_name, current_class)
-                                else:
-                                    class_attributes["classes"][class_name] = current_class
-
-                                for item in node.body:
-                                    if isinstance(item, ast.FunctionDef):
-                                        method_name = item.name
-                                        class_attributes["num_methods"] += 1
-                                        current_class["methods"].append(method_name)
-                                    elif isinstance(item, ast.Assign):
-                                        for target in item.targets:
-                                            if isinstance(target, ast.Name):
-                                                variable_name = target.id
-                                                class_attributes["num_variables"] += 1
-                                                current_class["attributes"].append(variable_name)
-                                    elif isinstance(item, ast.For): 
-                                        class_attributes["for_loops"] += 1
-                                        current_class["loops"] += 1
-                    except SyntaxError:
-                        print(f"Error parsing {file_path}. Skipping.")
-
-    return class_attributes
+# Commit index for a repo; None for repos the service doesn't serve or can't index, and
+# while a repo's first index is built. That build means a full clone (or a crawl of the
+# commits API), so it runs on the job queue rather than the request thread; with wait
+# it runs in this thread instead, for the command line tools.
+def get_commit_index(owner, repo, wait=False):
+    index = registry.commit_index(owner, repo, wait)
+    if index is None and not wait and registry.is_known(owner, repo):
+        try:
+            job_queue.submit(
+                index_job_id(owner, repo),
+                lambda: registry.commit_index(owner, repo) is not None,
+                FOREGROUND,
+            )
+        except QueueFull:
+            pass
+    return index
+
+# Payload for an already analyzed commit: the hot JSON cache first, then the compact
+# structure store, which keeps every analyzed commit
+def cached_d3_data(owner, repo, commit_hash):
+    d3_data = analysis_cache.get(owner, repo, commit_hash, ANALYZER_VERSION)
+    if d3_data is None:
+        d3_data = registry.structure_store(owner, repo).get(commit_hash, ANALYZER_VERSION)
+        if d3_data is not None:
+            analysis_cache.put(owner, repo, commit_hash, ANALYZER_VERSION, d3_data)
+    return d3_data
 
 def fetch_commit_hash(owner, repo, commit_number):
-    url = f"https://api.github.com/repos/{owner}/{repo}/commits?per_page=1&page={commit_number}"
-    #params = {"per_page": 1, "page": commit_number}
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
+    index = get_commit_index(owner, repo)
+    if index is not None:
+        commit_hash = index.sha(commit_number)
+        if commit_hash is None:
+            print("Commit not found.")
+        return commit_hash
+    status_code, data = github.get_json(f"repos/{owner}/{repo}/commits", {"per_page": 1, "page": commit_number})
+    if status_code == 200:
         if data:
             return data[0]["sha"]
         else:
             print("Commit not found.")
             return None
     else:
-        print(f"Failed to fetch commit hash. Status code: {response.status_code}")
+        print(f"Failed to fetch commit hash. Status code: {status_code}")
         return None
     
-def fetch_repository_files(owner, repo, commit_sha, target_dir):
-    if os.path.exists(target_dir):
-        shutil.rmtree(target_dir)
-    url = f"https://api.github.com/repos/{owner}/{repo}/tarball/{commit_sha}"
-    response = requests.get(url, stream=True)
+# Stream the commit's tarball from GitHub and analyze its .py members straight from
+# memory; nothing is written to disk. Returns None when the download fails.
+def fetch_repository_attributes(owner, repo, commit_sha, progress=None):
+    response = github.get_stream(f"repos/{owner}/{repo}/tarball/{commit_sha}")
     if response.status_code == 200:
-        with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
-            tar.extractall(path=target_dir)
+        with response:
+            return analyze_tarball(response.raw, fragment_cache, progress, blob_metric_cache)
     else:
+        response.close()
         print(f"Failed to fetch repository files. Status code: {response.status_code}")
+        return None
 
 # Function to fetch commit information including commit message from GitHub API
 def fetch_commit_info(owner, repo, commit_sha):
-    url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_sha}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
+    index = get_commit_index(owner, repo)
+    commit_number = index.ordinal(commit_sha) if index is not None else None
+    if commit_number is not None:
+        return index.message(commit_number)
+    status_code, data = github.get_json(f"repos/{owner}/{repo}/commits/{commit_sha}")
+    if status_code == 200:
         return data.get("commit").get("message")
     else:
-        print(f"Failed to fetch commit information. Status code: {response.status_code}")
+        print(f"Failed to fetch commit information. Status code: {status_code}")
         return None
 
 
+# Commit totals plus the package -> module -> class -> member tree
 def transform_to_d3_format(data):
     root = {
         "lines_of_code": data["lines_of_code"],
@@ -116,50 +140,518 @@ def transform_to_d3_format(data):
         "num_methods": data["num_methods"],
         "num_variables": data["num_variables"],
         "for_loops": data["for_loops"],
-        "children": []
+        "children": build_tree(data)
     }
-    for class_name, class_info in data["classes"].items():
-        class_node = {"name": class_name, "children": []}
-        if "methods" in class_info:
-            for method in class_info["methods"]:
-                class_node["children"].append({"name": method, "type": "method"})
-        if "attributes" in class_info:
-            for attribute in class_info["attributes"]:
-                class_node["children"].append({"name": attribute, "type": "attribute"})
-        root["children"].append(class_node)
     return root
 
+# Analyze a commit from the local bare clone, falling back to the GitHub tarball when
+# the clone is unavailable, and cache the result. Returns None if the commit can't be read.
+def build_d3_data(owner, repo, commit_hash):
+    key = (owner, repo, commit_hash)
+    progress = analysis_progress.begin(key)
+    try:
+        repository = GitRepository.open(owner, repo) if USE_GIT_BACKEND else None
+        if repository and repository.ensure_commit(commit_hash):
+            attributes = analyze_commit(repository, commit_hash, fragment_cache, progress, blob_metric_cache)
+            commit_message = repository.commit_message(commit_hash)
+        else:
+            # The commit message and the tarball come from independent calls; run them side by side
+            commit_message_future = github.submit(fetch_commit_info, owner, repo, commit_hash)
+            attributes = fetch_repository_attributes(owner, repo, commit_hash, progress)
+            commit_message = commit_message_future.result()
+            # Never serve or pin a partial result from a failed download
+            if attributes is None or commit_message is None:
+                return None
+    finally:
+        analysis_progress.end(key)
+
+    d3_data = transform_to_d3_format(attributes)
+    d3_data["commit_message"] = commit_message
+    title = repo + " by " + owner
+    d3_data["title"] = title
+    analysis_cache.put(owner, repo, commit_hash, ANALYZER_VERSION, d3_data)
+    registry.structure_store(owner, repo).put(commit_hash, ANALYZER_VERSION, d3_data)
+    metrics_store.put(owner, repo, commit_hash, ANALYZER_VERSION, attributes)
+    plugin_metrics_store.put(owner, repo, commit_hash, attributes["metrics"], plugin_versions())
+    # A new clone or more stored structures may have pushed the repos over the disk budget
+    registry.enforce_budget(keep=(owner, repo))
+    return d3_data
+
+# Analyze a commit at most once no matter how many requests ask for it at the same time:
+# threads in this process share one in-flight analysis, and a file lock per commit makes
+# other processes wait for it and then read the result from the cache. Lock files are
+# spread over directories by the sha's first two characters.
+def analyze_once(owner, repo, commit_hash):
+    def run():
+        with file_lock(os.path.join(LOCKS_DIR, owner, repo, commit_hash[:2], commit_hash + ".lock")):
+            d3_data = cached_d3_data(owner, repo, commit_hash)
+            if d3_data is None:
+                d3_data = build_d3_data(owner, repo, commit_hash)
+            return d3_data
+    d3_data = analyses_in_flight.do((owner, repo, commit_hash), run)
+    return dict(d3_data) if d3_data is not None else None
+
+# Cut of an analyzed commit's tree (see StructureStore.select), analyzing the commit first
+# if needed and allowed
+def selected_d3_data(owner, repo, commit_hash, path, depth, analyze):
+    store = registry.structure_store(owner, repo)
+    if analyze and not store.contains(commit_hash, ANALYZER_VERSION):
+        analyze_once(owner, repo, commit_hash)
+    return store.select(commit_hash, ANALYZER_VERSION, path, depth)
+
+# Precompressed payload entry for a commit, serialized and compressed only the first time.
+# path and depth cut the tree down to one subtree and a number of levels, read from the
+# structure store's index without building the full tree; each cut is kept as its own
+# variant. None when the commit can't be analyzed, with analyze=False when it hasn't been
+# yet, or when nothing lives at path.
+def prebuilt_payload(owner, repo, commit_hash, variant="", analyze=True, path=None, depth=None, **extra):
+    selected = bool(path) or depth is not None
+    if selected:
+        variant = f"{variant}|{path or ''}|{'' if depth is None else depth}"
+    entry = payload_cache.get(owner, repo, commit_hash, ANALYZER_VERSION, variant)
+    if entry is None:
+        if selected:
+            d3_data = selected_d3_data(owner, repo, commit_hash, path, depth, analyze)
+        else:
+            d3_data = cached_d3_data(owner, repo, commit_hash)
+            if d3_data is None and analyze:
+                d3_data = analyze_once(owner, repo, commit_hash)
+        if d3_data is None:
+            return None
+        d3_data.update(extra)
+        entry = encode_payload(d3_data)
+        payload_cache.put(owner, repo, commit_hash, ANALYZER_VERSION, variant, entry)
+    return entry
+
+# Fragments of the given blobs, parsing (and caching) any the fragment cache has dropped
+def load_fragments(repository, shas):
+    fragments = fragment_cache.get_many(shas, ANALYZER_VERSION)
+    missing = [sha for sha in shas if sha not in fragments]
+    if missing:
+        fresh, _ = analyze_sources(repository.read_blobs(missing))
+        fragment_cache.put_many(fresh, ANALYZER_VERSION)
+        fragments.update(fresh)
+    return fragments
+
+# Warm the payload the structure endpoint serves for a commit. Runs on the job queue.
+def warm_commit(owner, repo, commit_hash):
+    return prebuilt_payload(owner, repo, commit_hash, sha=commit_hash) is not None
+
+def analysis_job_id(owner, repo, commit_hash):
+    return f"{owner}/{repo}/{commit_hash}"
+
+# Build a commit's inheritance DAG from the repo's symbol table into the payload cache.
+# Runs on the job queue, after the commit's analysis has left its fragments cached.
+def warm_inheritance(owner, repo, commit_hash):
+    repository = GitRepository.open(owner, repo, clone=False)
+    if repository is None or not repository.has_commit(commit_hash):
+        return False
+    classes = registry.symbol_table(owner, repo).inheritance(
+        repository.list_files(commit_hash),
+        lambda shas: load_fragments(repository, shas),
+    )
+    entry = encode_payload({
+        "sha": commit_hash,
+        "classes": classes,
+        "external": sorted({base for bases in classes.values() for base in bases if base not in classes}),
+    })
+    payload_cache.put(owner, repo, commit_hash, ANALYZER_VERSION, INHERITANCE_VARIANT, entry)
+    return True
+
+prefetcher = Prefetcher(job_queue, analysis_job_id, warm_commit)
+
+# Structure of a commit as the running analyzer builds it. The version in the URL is what
+# lets the response be cached for good: a new analyzer hands out new URLs.
+def structure_url(owner, repo, commit_hash):
+    return url_for('commit_structure', owner=owner, repo=repo, sha=commit_hash, v=ANALYZER_VERSION)
+
+# Cache-Control for a response addressed by sha: immutable when the request names the
+# current analyzer version, otherwise revalidated by ETag, as the output of a sha still
+# changes whenever the analyzer does
+def sha_cache_control():
+    if request.args.get('v', type=int) == ANALYZER_VERSION:
+        return 'public, max-age=31536000, immutable'
+    return 'no-cache'
+
+# What a client needs to know about an analysis job; None stands for one that finished
+# in another process
+def job_state(owner, repo, commit_hash, job):
+    status = job.status if job is not None else DONE
+    # The job ran but the commit couldn't be read
+    if status == DONE and job is not None and not job.result:
+        status = FAILED
+    body = {
+        "id": analysis_job_id(owner, repo, commit_hash),
+        "status": status,
+        "status_url": url_for('job_status', owner=owner, repo=repo, sha=commit_hash),
+        "progress_url": url_for('commit_progress', owner=owner, repo=repo, sha=commit_hash),
+    }
+    if status == DONE:
+        body["structure_url"] = structure_url(owner, repo, commit_hash)
+    elif status == FAILED:
+        body["error"] = (job.error if job is not None else None) or 'Failed to analyze commit'
+    return body
+
+def job_response(owner, repo, commit_hash, job, status_code=200):
+    response = jsonify(job_state(owner, repo, commit_hash, job))
+    response.status_code = status_code
+    if job is not None and job.pending:
+        response.headers['Retry-After'] = '1'
+    return response
+
+def submit_analysis(owner, repo, commit_hash):
+    return job_queue.submit(
+        analysis_job_id(owner, repo, commit_hash),
+        lambda: warm_commit(owner, repo, commit_hash),
+        FOREGROUND,
+    )
+
+def queue_full():
+    response = jsonify({'error': 'Too many analyses queued, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(QUEUE_FULL_RETRY_AFTER)
+    return response
+
+# Hand a cold commit to the job queue instead of analyzing it on the request thread:
+# 202 with the job to poll, or 503 when the queue is full
+def queue_analysis(owner, repo, commit_hash):
+    try:
+        job = submit_analysis(owner, repo, commit_hash)
+    except QueueFull:
+        return queue_full()
+    response = job_response(owner, repo, commit_hash, job, 202)
+    response.headers['Location'] = url_for('job_status', owner=owner, repo=repo, sha=commit_hash)
+    return response
+
+# Send a prebuilt payload as-is in the best encoding the client accepts, or a 304 when
+# the client already holds it
+def send_payload(entry, cache_control):
+    encoding = choose_encoding(entry, request.accept_encodings)
+    etag = etag_for(entry, encoding)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body, encoding = negotiate(entry, request.accept_encodings)
+        response = app.response_class(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+def unknown_repository(owner, repo):
+    return jsonify({'error': f'Unknown repository {owner}/{repo}'}), 404
+
+# 503 until a repo's commit index exists, with how long to wait: shortly while its first
+# build is running, COMMIT_INDEX_RETRY_AFTER after a build failed
+def index_unavailable(owner, repo):
+    job = job_queue.get(index_job_id(owner, repo))
+    if job is not None and job.pending:
+        response = jsonify({'error': 'The commit index is being built, try again shortly'})
+        response.headers['Retry-After'] = str(INDEX_BUILD_RETRY_AFTER)
+    else:
+        response = jsonify({'error': 'Failed to load commit index'})
+        response.headers['Retry-After'] = str(COMMIT_INDEX_RETRY_AFTER)
+    response.status_code = 503
+    return response
+
+# None when sha is a commit of the repo, going by the commit index and the local clone
+# only, otherwise the response to send: 404, or 503 while the index isn't there to ask.
+# Nothing is fetched, so made-up shas can't spend git fetches, API calls or job workers.
+def check_commit(owner, repo, sha):
+    index = get_commit_index(owner, repo)
+    if index is not None and index.ordinal(sha) is not None:
+        return None
+    repository = GitRepository.open(owner, repo, clone=False) if USE_GIT_BACKEND else None
+    if repository is not None and repository.has_commit(sha):
+        return None
+    if index is None:
+        return index_unavailable(owner, repo)
+    return jsonify({'error': f'Unknown commit {sha}'}), 404
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(app.root_path, 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 @app.route('/get_d3_data', methods=['POST'])
 def get_d3_data():
-    data = request.json
-    owner = "psf"
-    repo = "requests"
-    commit_number = data['commit_number']
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object with commit_number is required'}), 400
+    owner = data.get('owner', DEFAULT_OWNER)
+    repo = data.get('repo', DEFAULT_REPO)
+    try:
+        commit_number = int(data['commit_number'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'commit_number must be an integer'}), 400
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    if get_commit_index(owner, repo) is None:
+        return index_unavailable(owner, repo)
 
     commit_hash = fetch_commit_hash(owner, repo, commit_number)
     if commit_hash:
-        fetch_repository_files(owner, repo, commit_hash, "repo_files")
-        project_directory = f"{owner}-{repo}-{commit_hash[:7]}"
-        attributes = extract_project_attributes("repo_files/"+project_directory, owner, repo)
-
-        commit_message = fetch_commit_info(owner, repo, commit_hash)
-        d3_data = transform_to_d3_format(attributes)
-        d3_data["commit_message"] = commit_message
-        title = repo + " by " + owner
-        d3_data["title"] = title
-        d3_data["commit_number"] = commit_number
-        
-        response = jsonify(d3_data)
-        response.headers.add('Access-Control-Allow-Origin', '*') 
+        entry = prebuilt_payload(owner, repo, commit_hash, commit_number, analyze=False, commit_number=commit_number)
         print(commit_hash)
+        if entry is None:
+            response = queue_analysis(owner, repo, commit_hash)
+        else:
+            # The number a commit answers to shifts as commits land, so always revalidate
+            response = send_payload(entry, 'no-cache')
+        # Neighbours are queued after the commit asked for, never ahead of it
+        prefetcher.focus(owner, repo, get_commit_index(owner, repo), commit_number)
         return response
     else:
         print(commit_hash)
         return jsonify({'error': 'Failed to fetch commit hash'})
 
+# Every repository the service serves
+@app.route('/repos', methods=['GET'])
+def repositories():
+    return jsonify([{"owner": owner, "repo": repo} for owner, repo in registry.known()])
+
+# How many commits a repo has, which is the range of its slider
+@app.route('/repos/<owner>/<repo>', methods=['GET'])
+def repository(owner, repo):
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    index = get_commit_index(owner, repo)
+    if index is None:
+        return index_unavailable(owner, repo)
+    response = jsonify({
+        "owner": owner,
+        "repo": repo,
+        "title": repo + " by " + owner,
+        "commit_count": len(index),
+        "head": index.sha(1),
+    })
+    response.headers['Cache-Control'] = f'public, max-age={RESOLVE_MAX_AGE}'
+    return response
+
+# Which commit a slider number currently means. Short-lived, since the answer shifts as
+# commits land; the structure itself is then fetched by sha.
+@app.route('/repos/<owner>/<repo>/resolve', methods=['GET'])
+def resolve_commit(owner, repo):
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    commit_number = request.args.get('commit_number', type=int)
+    if commit_number is None:
+        return jsonify({'error': 'commit_number is required'}), 400
+    if get_commit_index(owner, repo) is None:
+        return index_unavailable(owner, repo)
+    commit_hash = fetch_commit_hash(owner, repo, commit_number)
+    if not commit_hash:
+        return jsonify({'error': 'Failed to fetch commit hash'}), 404
+    # The client is about to fetch this commit: start on it now, then on the ones next to it
+    if not registry.structure_store(owner, repo).contains(commit_hash, ANALYZER_VERSION):
+        try:
+            submit_analysis(owner, repo, commit_hash)
+        except QueueFull:
+            pass
+    prefetcher.focus(owner, repo, get_commit_index(owner, repo), commit_number)
+    response = jsonify({
+        "commit_number": commit_number,
+        "sha": commit_hash,
+        "structure_url": structure_url(owner, repo, commit_hash),
+    })
+    response.headers['Cache-Control'] = f'public, max-age={RESOLVE_MAX_AGE}'
+    return response
+
+# The d3 payload for a commit addressed by its full sha. With ?v= naming the analyzer
+# version (as in the structure_url handed out by /resolve and the job endpoints) the
+# response never changes, so browsers, proxies and CDNs may keep it forever. ?path=requests.sessions narrows it to
+# the package, module or class at that qualified name, and ?depth=N to N levels below it;
+# containers cut off by depth come with "truncated" and the counts of what they hold, so
+# clients can fetch the tree a level at a time as the user zooms in.
+@app.route('/repos/<owner>/<repo>/commits/<sha>/structure', methods=['GET'])
+def commit_structure(owner, repo, sha):
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    if not FULL_SHA.fullmatch(sha):
+        return jsonify({'error': 'A full 40-character commit sha is required'}), 400
+    path = request.args.get('path') or None
+    depth = request.args.get('depth', type=int)
+    if 'depth' in request.args and (depth is None or depth < 1):
+        return jsonify({'error': 'depth must be a positive integer'}), 400
+    entry = prebuilt_payload(owner, repo, sha, analyze=False, path=path, depth=depth, sha=sha)
+    if entry is None:
+        if path and registry.structure_store(owner, repo).contains(sha, ANALYZER_VERSION):
+            return jsonify({'error': f'Nothing named {path} in this commit'}), 404
+        refused = check_commit(owner, repo, sha)
+        if refused is not None:
+            return refused
+        return queue_analysis(owner, repo, sha)
+    return send_payload(entry, sha_cache_control())
+
+# Server-Sent Events while a commit is analyzed: "start" with the file count, "progress"
+# with files and bytes done and running class/method totals, "classes" with d3 nodes for
+# classes as they are found, and a final "done" (with structure_url) or "failed". Starts
+# the analysis if it isn't running. Progress is only seen in the worker process running
+# the analysis; elsewhere the stream goes straight from queued to the outcome. A stream
+# ties up a worker thread until the analysis ends, so the dashboard long-polls /jobs
+# unless opened with ?progress=stream.
+@app.route('/repos/<owner>/<repo>/commits/<sha>/progress', methods=['GET'])
+def commit_progress(owner, repo, sha):
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    if not FULL_SHA.fullmatch(sha):
+        return jsonify({'error': 'A full 40-character commit sha is required'}), 400
+    job = None
+    if not registry.structure_store(owner, repo).contains(sha, ANALYZER_VERSION):
+        refused = check_commit(owner, repo, sha)
+        if refused is not None:
+            return refused
+        try:
+            job = submit_analysis(owner, repo, sha)
+        except QueueFull:
+            return queue_full()
+
+    def stream():
+        if job is not None:
+            yield format_event("queued", job_state(owner, repo, sha, job))
+            for item in analysis_progress.follow((owner, repo, sha), lambda: not job.pending):
+                yield ": keepalive\n\n" if item is None else format_event(*item)
+            job.wait()
+        state = job_state(owner, repo, sha, job)
+        yield format_event(state["status"], state)
+
+    response = app.response_class(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Inheritance DAG of a commit: every class by qualified name with its bases, resolved
+# through imports, aliases and re-exports across files. Bases outside the project keep
+# the dotted name they resolve to and are listed under "external". Built on the job
+# queue from the repo's symbol table, which only re-reads files that changed since the
+# commit it last answered for, so it needs the local clone. Until it is built the answer
+# is 202 with Retry-After; ?wait=N holds the request up to N seconds for it. Shas that
+# neither the clone nor the commit index know are refused without fetching. Cached like
+# the structure, by ?v=.
+@app.route('/repos/<owner>/<repo>/commits/<sha>/inheritance', methods=['GET'])
+def commit_inheritance(owner, repo, sha):
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    if not FULL_SHA.fullmatch(sha):
+        return jsonify({'error': 'A full 40-character commit sha is required'}), 400
+    if not USE_GIT_BACKEND:
+        return jsonify({'error': 'Inheritance needs a local clone holding the commit'}), 503
+    entry = payload_cache.get(owner, repo, sha, ANALYZER_VERSION, INHERITANCE_VARIANT)
+    if entry is not None:
+        return send_payload(entry, sha_cache_control())
+    refused = check_commit(owner, repo, sha)
+    if refused is not None:
+        return refused
+    # Analyzing the commit first leaves its fragments in the cache
+    if not registry.structure_store(owner, repo).contains(sha, ANALYZER_VERSION):
+        return queue_analysis(owner, repo, sha)
+
+    try:
+        job = job_queue.submit(
+            analysis_job_id(owner, repo, sha) + "/inheritance",
+            lambda: warm_inheritance(owner, repo, sha),
+            FOREGROUND,
+        )
+    except QueueFull:
+        return queue_full()
+    wait = min(request.args.get('wait', 0, type=float), MAX_JOB_WAIT)
+    if wait > 0:
+        job.wait(wait)
+    if not job.pending:
+        entry = payload_cache.get(owner, repo, sha, ANALYZER_VERSION, INHERITANCE_VARIANT)
+        if entry is None:
+            return jsonify({'error': job.error or 'Failed to build the inheritance graph'}), 503
+        return send_payload(entry, sha_cache_control())
+    response = jsonify({'status': job.status})
+    response.status_code = 202
+    response.headers['Retry-After'] = '1'
+    response.headers['Location'] = url_for('commit_inheritance', owner=owner, repo=repo, sha=sha, **request.args.to_dict())
+    return response
+
+# State of a queued analysis. With ?wait=N the request is held until the job finishes or
+# N seconds (at most MAX_JOB_WAIT) pass, so clients can long-poll instead of spinning.
+@app.route('/jobs/<owner>/<repo>/<sha>', methods=['GET'])
+def job_status(owner, repo, sha):
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    if not FULL_SHA.fullmatch(sha):
+        return jsonify({'error': 'A full 40-character commit sha is required'}), 400
+    job = job_queue.get(analysis_job_id(owner, repo, sha))
+    if job is None:
+        # Queued by another worker process, or finished long ago: the store has the answer
+        if registry.structure_store(owner, repo).contains(sha, ANALYZER_VERSION):
+            return job_response(owner, repo, sha, None)
+        refused = check_commit(owner, repo, sha)
+        if refused is not None:
+            return refused
+        # Otherwise pick the work up here; analyze_once keeps it from running twice
+        return queue_analysis(owner, repo, sha)
+    wait = min(request.args.get('wait', 0, type=float), MAX_JOB_WAIT)
+    if wait > 0:
+        job.wait(wait)
+    return job_response(owner, repo, sha, job)
+
+# LOC/classes/methods/variables/loops and the metric plugins across a range of commits as
+# columnar arrays, from precomputed metrics only (run `python -m app precompute` to fill
+# them in, and `python -m app backfill-metrics` after adding a plugin)
+@app.route('/timeline', methods=['GET'])
+def timeline():
+    owner = request.args.get('owner', DEFAULT_OWNER)
+    repo = request.args.get('repo', DEFAULT_REPO)
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    index = get_commit_index(owner, repo)
+    if index is None:
+        return index_unavailable(owner, repo)
+    start = request.args.get('start', 1, type=int)
+    end = request.args.get('end', len(index), type=int)
+    points = request.args.get('points', 500, type=int)
+    metrics = metrics_store.get_all(owner, repo, ANALYZER_VERSION)
+    versions = plugin_versions()
+    plugin_metrics = plugin_metrics_store.get_all(owner, repo, versions.items())
+    return jsonify(build_timeline(index, metrics, start, end, points, plugin_metrics, list(versions)))
+
+# Packages, modules, classes and members added, removed or renamed between two analyzed
+# commits, for API clients holding a complete tree. The dashboard loads trees a few levels
+# at a time, which a whole-tree delta can't patch, so it always fetches by sha.
+@app.route('/diff', methods=['GET'])
+def diff():
+    owner = request.args.get('owner', DEFAULT_OWNER)
+    repo = request.args.get('repo', DEFAULT_REPO)
+    if not registry.is_known(owner, repo):
+        return unknown_repository(owner, repo)
+    from_number = request.args.get('from', type=int)
+    to_number = request.args.get('to', type=int)
+    if from_number is None or to_number is None:
+        return jsonify({'error': 'from and to commit numbers are required'}), 400
+
+    from_hash = fetch_commit_hash(owner, repo, from_number)
+    to_hash = fetch_commit_hash(owner, repo, to_number)
+    if not from_hash or not to_hash:
+        return jsonify({'error': 'Failed to fetch commit hash'}), 404
+    old = cached_d3_data(owner, repo, from_hash)
+    new = cached_d3_data(owner, repo, to_hash)
+    if old is None or new is None:
+        return jsonify({'error': 'Commit not analyzed yet'}), 404
+
+    summary = {key: value for key, value in new.items() if key != "children"}
+    summary["commit_number"] = to_number
+    return jsonify({
+        "from": from_number,
+        "to": to_number,
+        "summary": summary,
+        "classes": diff_structures(old, new),
+    })
+
 if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['precompute']:
+        from precompute import main
+        sys.exit(main(sys.argv[2:]))
+    if sys.argv[1:2] == ['backfill-metrics']:
+        from backfill import main
+        sys.exit(main(sys.argv[2:]))
     app.run()
\ No newline at end of file
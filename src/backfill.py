@@ -0,0 +1,68 @@
+import argparse
+import time
+
+import app
+from analyzer import ANALYZER_VERSION, measure_sources
+from git_backend import GitRepository
+from metrics import combine_metrics, plugin_versions
+
+# Blobs read out of the clone and measured at a time
+BATCH_SIZE = 2000
+
+
+# Compute metric plugins that are missing for commits already analyzed, without touching
+# their structural analysis: every distinct file blob across those commits is parsed once
+# for all of its missing plugins, then the commit totals are summed from the blob values.
+def backfill(owner, repo):
+    if not app.registry.is_known(owner, repo):
+        print(f"{owner}/{repo} is not served; add it to CODEBLUEPRINT_REPOS or clone it into the repos directory.")
+        return 1
+    repository = GitRepository.open(owner, repo)
+    if repository is None:
+        print(f"Backfilling reads blobs from a local clone, and {owner}/{repo} could not be cloned.")
+        return 1
+
+    versions = plugin_versions()
+    analyzed = app.metrics_store.get_all(owner, repo, ANALYZER_VERSION)
+    done = app.plugin_metrics_store.get_all(owner, repo, versions.items())
+    commits = [sha for sha in analyzed if set(done.get(sha, {})) != set(versions)]
+    print(f"Backfilling {', '.join(versions)} for {len(commits)} of {len(analyzed)} analyzed commits of {owner}/{repo}")
+    if not commits:
+        return 0
+
+    began = time.time()
+    trees = {sha: repository.list_files(sha) for sha in commits}
+    blobs = sorted({blob for entries in trees.values() for _, blob in entries})
+    measured = app.blob_metric_cache.get_many(blobs, versions.items())
+    unmeasured = {}
+    for blob in blobs:
+        names = [name for name in versions if name not in measured.get(blob, {})]
+        if names:
+            unmeasured[blob] = names
+    print(f"  {len(blobs)} distinct files, {len(unmeasured)} to measure")
+
+    pending = sorted(unmeasured)
+    for start in range(0, len(pending), BATCH_SIZE):
+        batch = pending[start:start + BATCH_SIZE]
+        contents = repository.read_blobs(batch)
+        values = measure_sources({blob: (contents[blob], unmeasured[blob]) for blob in batch})
+        app.blob_metric_cache.put_many(values, versions)
+        for blob, blob_values in values.items():
+            measured.setdefault(blob, {}).update(blob_values)
+        print(f"  {min(start + BATCH_SIZE, len(pending))}/{len(pending)} files measured", flush=True)
+
+    for sha in commits:
+        totals = combine_metrics([measured.get(blob, {}) for _, blob in trees[sha]])
+        app.plugin_metrics_store.put(owner, repo, sha, totals, versions)
+    print(f"Done in {time.time() - began:.1f}s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app backfill-metrics", description="Compute newly added metric plugins over already analyzed commits.")
+    parser.add_argument("--repo", default="psf/requests", help="owner/name of the repository (default: psf/requests)")
+    args = parser.parse_args(argv)
+    owner, _, repo = args.repo.partition("/")
+    if not owner or not repo:
+        parser.error("--repo must look like owner/name")
+    return backfill(owner, repo)
@@ -0,0 +1,74 @@
+import argparse
+import ast
+import io
+import os
+import time
+
+from analyzer import analyze_source
+
+DEFAULT_TREE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repo_files", "psf-requests-1b41763")
+
+
+# The analyzer as it was before ProjectVisitor: ast.walk, then a re-scan of every class body
+def legacy_analyze_source(text):
+    code_lines = io.StringIO(text, newline=None).readlines()
+    classes = []
+    tree = ast.parse("".join(code_lines))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            current_class = {"name": node.name, "parent": None, "methods": [], "attributes": [], "loops": 0}
+            for base_class in node.bases:
+                if isinstance(base_class, ast.Name):
+                    current_class["parent"] = base_class.id
+                    break
+            for item in node.body:
+                if isinstance(item, ast.FunctionDef):
+                    current_class["methods"].append(item.name)
+                elif isinstance(item, ast.Assign):
+                    for target in item.targets:
+                        if isinstance(target, ast.Name):
+                            current_class["attributes"].append(target.id)
+                elif isinstance(item, ast.For):
+                    current_class["loops"] += 1
+            classes.append(current_class)
+    return classes
+
+
+def load_sources(directory):
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".py"):
+                with open(os.path.join(root, filename), "rb") as f:
+                    sources.append(f.read().decode("utf-8", errors="replace"))
+    return sources
+
+
+def best_of(repeat, fn, sources):
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        for source in sources:
+            fn(source)
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-file throughput of the analyzer, old vs new.")
+    parser.add_argument("directory", nargs="?", default=DEFAULT_TREE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    sources = load_sources(args.directory)
+    total_bytes = sum(len(source) for source in sources)
+    print(f"{len(sources)} files, {total_bytes / 1024:.0f} KiB in {args.directory}")
+    for label, fn in (("legacy ast.walk", legacy_analyze_source), ("ProjectVisitor", analyze_source)):
+        elapsed = best_of(args.repeat, fn, sources)
+        print(f"  {label:16} {elapsed * 1000:8.1f} ms  {len(sources) / elapsed:8.0f} files/s  "
+              f"{elapsed * 1000 / len(sources):6.2f} ms/file  {total_bytes / elapsed / 1e6:6.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+import json
+import os
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+import zlib
+
+CACHE_DIR = os.environ.get("CODEBLUEPRINT_CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CODEBLUEPRINT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get("CODEBLUEPRINT_FRAGMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Fragments kept decoded in process memory in front of SQLite
+FRAGMENT_MEMORY_ITEMS = int(os.environ.get("CODEBLUEPRINT_FRAGMENT_MEMORY_ITEMS", 20000))
+# Seconds a process trusts its running total of a table's size before summing it again;
+# other processes write to the same tables
+SIZE_RECOUNT_INTERVAL = 60
+# Eviction goes this far below max_bytes, so the next writes don't start it over at once
+EVICT_TO = 0.9
+# Least recently used rows read per eviction query
+EVICT_BATCH = 256
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+# SQLite file shared by the caches below, with one connection per thread.
+# Connections are never reused across a fork, so precompute workers get their own.
+class _Store:
+    def __init__(self, path, max_bytes):
+        self.path = path or os.path.join(CACHE_DIR, "analysis.sqlite3")
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        # {table: (estimated total size, when it was last summed)}
+        self._sizes = {}
+        self._sizes_lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            self._create(conn)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def total_size(self, table):
+        return self._connect().execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+
+    # Count bytes just written to table toward its running total, then evict if needed
+    def _grew(self, table, key_columns, added):
+        with self._sizes_lock:
+            if table in self._sizes:
+                total, counted_at = self._sizes[table]
+                self._sizes[table] = (total + added, counted_at)
+        self.evict(table, key_columns)
+
+    # Delete least recently used rows of table until it is back under max_bytes. The
+    # table is only summed when the running total says it is over budget or is too old
+    # to trust, and rows are read oldest first a batch at a time.
+    def evict(self, table, key_columns):
+        if self.max_bytes is None:
+            return
+        with self._sizes_lock:
+            total, counted_at = self._sizes.get(table, (None, 0))
+        if total is not None and total <= self.max_bytes and time.time() - counted_at < SIZE_RECOUNT_INTERVAL:
+            return
+        conn = self._connect()
+        total = self.total_size(table)
+        if total > self.max_bytes:
+            excess = total - int(self.max_bytes * EVICT_TO)
+            where = " AND ".join(f"{column}=?" for column in key_columns)
+            with conn:
+                while excess > 0:
+                    rows = conn.execute(
+                        f"SELECT {', '.join(key_columns)}, size FROM {table} ORDER BY last_access LIMIT ?",
+                        (EVICT_BATCH,),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    for row in rows:
+                        if excess <= 0:
+                            break
+                        conn.execute(f"DELETE FROM {table} WHERE {where}", row[:-1])
+                        excess -= row[-1]
+                        total -= row[-1]
+        with self._sizes_lock:
+            self._sizes[table] = (total, time.time())
+
+
+# Per-commit analysis results, keyed by (owner, repo, commit sha, analyzer version).
+# Payloads are stored as zlib-compressed JSON and evicted least-recently-used
+# once the total compressed size goes over max_bytes.
+class AnalysisCache(_Store):
+    def __init__(self, path=None, max_bytes=CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " owner TEXT NOT NULL,"
+            " repo TEXT NOT NULL,"
+            " sha TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " payload BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (owner, repo, sha, version))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS analyses_lru ON analyses (last_access)")
+
+    def get(self, owner, repo, sha, version):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT payload FROM analyses WHERE owner=? AND repo=? AND sha=? AND version=?",
+            (owner, repo, sha, version),
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE analyses SET last_access=? WHERE owner=? AND repo=? AND sha=? AND version=?",
+                (time.time(), owner, repo, sha, version),
+            )
+        return _decode(row[0])
+
+    def contains(self, owner, repo, sha, version):
+        row = self._connect().execute(
+            "SELECT 1 FROM analyses WHERE owner=? AND repo=? AND sha=? AND version=?",
+            (owner, repo, sha, version),
+        ).fetchone()
+        return row is not None
+
+    def put(self, owner, repo, sha, version, payload):
+        blob = _encode(payload)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (owner, repo, sha, version, payload, size, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (owner, repo, sha, version, blob, len(blob), time.time()),
+            )
+        self._grew("analyses", ("owner", "repo", "sha", "version"), len(blob))
+
+    def delete_repo(self, owner, repo):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM analyses WHERE owner=? AND repo=?", (owner, repo))
+
+
+# Per-file analysis fragments, keyed by (git blob sha, analyzer version). Identical file
+# contents are shared across commits and repositories, so walking history only parses
+# files whose content actually changed.
+class FragmentCache(_Store):
+    def __init__(self, path=None, max_bytes=FRAGMENT_CACHE_MAX_BYTES, memory_items=FRAGMENT_MEMORY_ITEMS):
+        super().__init__(path, max_bytes)
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+
+    def _remember(self, version, fragments):
+        with self._memory_lock:
+            for sha, fragment in fragments.items():
+                self._memory[(sha, version)] = fragment
+                self._memory.move_to_end((sha, version))
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS fragments ("
+            " blob_sha TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " fragment BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (blob_sha, version))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS fragments_lru ON fragments (last_access)")
+
+    def get_many(self, blob_shas, version):
+        found = {}
+        with self._memory_lock:
+            for sha in set(blob_shas):
+                fragment = self._memory.get((sha, version))
+                if fragment is not None:
+                    self._memory.move_to_end((sha, version))
+                    found[sha] = fragment
+        blob_shas = [sha for sha in set(blob_shas) if sha not in found]
+        if not blob_shas:
+            return found
+        conn = self._connect()
+        stored = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(blob_shas), 500):
+            chunk = blob_shas[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT blob_sha, fragment FROM fragments WHERE version=? AND blob_sha IN ({placeholders})",
+                [version] + chunk,
+            ).fetchall()
+            for sha, blob in rows:
+                stored[sha] = _decode(blob)
+        if stored:
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "UPDATE fragments SET last_access=? WHERE blob_sha=? AND version=?",
+                    [(now, sha, version) for sha in stored],
+                )
+            self._remember(version, stored)
+            found.update(stored)
+        return found
+
+    def put_many(self, fragments, version):
+        self._remember(version, fragments)
+        now = time.time()
+        rows = []
+        for sha, fragment in fragments.items():
+            blob = _encode(fragment)
+            rows.append((sha, version, blob, len(blob), now))
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fragments (blob_sha, version, fragment, size, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        self._grew("fragments", ("blob_sha", "version"), sum(row[3] for row in rows))
+
+
+BLOB_METRIC_CACHE_MAX_BYTES = int(os.environ.get("CODEBLUEPRINT_BLOB_METRIC_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+# Plugin metric values per file, keyed by (git blob sha, metric name, metric version).
+# Kept apart from the fragments so a new or changed metric only computes itself.
+class BlobMetricCache(_Store):
+    def __init__(self, path=None, max_bytes=BLOB_METRIC_CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blob_metrics ("
+            " blob_sha TEXT NOT NULL,"
+            " metric TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (blob_sha, metric, version))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS blob_metrics_lru ON blob_metrics (last_access)")
+
+    # {blob sha: {name: value}} for the (name, version) pairs asked for, where cached
+    def get_many(self, blob_shas, metrics):
+        blob_shas = list(set(blob_shas))
+        versions = dict(metrics)
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(blob_shas), 500):
+            chunk = blob_shas[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT blob_sha, metric, version, value FROM blob_metrics WHERE blob_sha IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            for sha, name, version, value in rows:
+                if versions.get(name) == version:
+                    found.setdefault(sha, {})[name] = json.loads(value)
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "UPDATE blob_metrics SET last_access=? WHERE blob_sha=?",
+                    [(now, sha) for sha in found],
+                )
+        return found
+
+    # values is {blob sha: {name: value}}, versions is {name: version}
+    def put_many(self, values, versions):
+        now = time.time()
+        rows = []
+        for sha, metrics in values.items():
+            for name, value in metrics.items():
+                encoded = json.dumps(value)
+                rows.append((sha, name, versions[name], encoded, len(sha) + len(name) + len(encoded), now))
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO blob_metrics (blob_sha, metric, version, value, size, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        self._grew("blob_metrics", ("blob_sha", "metric", "version"), sum(row[4] for row in rows))
+
+
+METRIC_COLUMNS = ("lines_of_code", "num_classes", "num_methods", "num_variables", "for_loops")
+
+
+# Headline totals for every analyzed commit. Rows are tiny and never evicted, so the
+# timeline stays complete even after the full payloads age out of AnalysisCache.
+class MetricsStore(_Store):
+    def __init__(self, path=None):
+        super().__init__(path, None)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS commit_metrics ("
+            " owner TEXT NOT NULL,"
+            " repo TEXT NOT NULL,"
+            " sha TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            + "".join(f" {column} INTEGER NOT NULL," for column in METRIC_COLUMNS) +
+            " PRIMARY KEY (owner, repo, sha, version))"
+        )
+
+    def put(self, owner, repo, sha, version, attributes):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO commit_metrics (owner, repo, sha, version, {', '.join(METRIC_COLUMNS)})"
+                f" VALUES (?, ?, ?, ?{', ?' * len(METRIC_COLUMNS)})",
+                (owner, repo, sha, version) + tuple(attributes[column] for column in METRIC_COLUMNS),
+            )
+
+    # {sha: (lines_of_code, num_classes, num_methods, num_variables, for_loops)}
+    def get_all(self, owner, repo, version):
+        rows = self._connect().execute(
+            f"SELECT sha, {', '.join(METRIC_COLUMNS)} FROM commit_metrics WHERE owner=? AND repo=? AND version=?",
+            (owner, repo, version),
+        ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+
+# Plugin metric totals for every analyzed commit, one row per (commit, metric, version).
+# Like MetricsStore, never evicted.
+class PluginMetricsStore(_Store):
+    def __init__(self, path=None):
+        super().__init__(path, None)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS commit_plugin_metrics ("
+            " owner TEXT NOT NULL,"
+            " repo TEXT NOT NULL,"
+            " sha TEXT NOT NULL,"
+            " metric TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " value NUMERIC,"
+            " PRIMARY KEY (owner, repo, sha, metric, version))"
+        )
+
+    # values is {name: value}, versions is {name: version}
+    def put(self, owner, repo, sha, values, versions):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO commit_plugin_metrics (owner, repo, sha, metric, version, value)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(owner, repo, sha, name, versions[name], value) for name, value in values.items()],
+            )
+
+    # {sha: {name: value}} for the (name, version) pairs asked for
+    def get_all(self, owner, repo, metrics):
+        versions = dict(metrics)
+        rows = self._connect().execute(
+            "SELECT sha, metric, version, value FROM commit_plugin_metrics WHERE owner=? AND repo=?",
+            (owner, repo),
+        ).fetchall()
+        found = {}
+        for sha, name, version, value in rows:
+            if versions.get(name) == version:
+                found.setdefault(sha, {})[name] = value
+        return found
+
+
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("CODEBLUEPRINT_HTTP_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+# GitHub JSON responses with their validators, so repeat calls can be revalidated with a
+# conditional request (or skipped entirely when the URL is immutable)
+class ResponseCache(_Store):
+    def __init__(self, path=None, max_bytes=HTTP_CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS http_responses ("
+            " url TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " immutable INTEGER NOT NULL,"
+            " body BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS http_responses_lru ON http_responses (last_access)")
+
+    # {"etag", "last_modified", "immutable", "body"} or None
+    def get(self, url):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT etag, last_modified, immutable, body FROM http_responses WHERE url=?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE http_responses SET last_access=? WHERE url=?", (time.time(), url))
+        return {"etag": row[0], "last_modified": row[1], "immutable": bool(row[2]), "body": _decode(row[3])}
+
+    def put(self, url, etag, last_modified, immutable, body):
+        blob = _encode(body)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO http_responses (url, etag, last_modified, immutable, body, size, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, int(immutable), blob, len(blob), time.time()),
+            )
+        self._grew("http_responses", ("url",), len(blob))
+
+
+PAYLOAD_CACHE_MAX_BYTES = int(os.environ.get("CODEBLUEPRINT_PAYLOAD_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+# Serialized, precompressed response bodies ready to send as-is, keyed like AnalysisCache
+# plus the variant of the payload (e.g. which commit number it was requested as)
+class PayloadCache(_Store):
+    def __init__(self, path=None, max_bytes=PAYLOAD_CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def _create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS payloads ("
+            " owner TEXT NOT NULL,"
+            " repo TEXT NOT NULL,"
+            " sha TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " variant TEXT NOT NULL,"
+            " etag TEXT NOT NULL,"
+            " gzip BLOB NOT NULL,"
+            " br BLOB,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (owner, repo, sha, version, variant))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS payloads_lru ON payloads (last_access)")
+
+    # {"etag", "gzip", "br"} or None
+    def get(self, owner, repo, sha, version, variant=""):
+        key = (owner, repo, sha, version, str(variant))
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT etag, gzip, br FROM payloads WHERE owner=? AND repo=? AND sha=? AND version=? AND variant=?", key
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE payloads SET last_access=? WHERE owner=? AND repo=? AND sha=? AND version=? AND variant=?",
+                (time.time(),) + key,
+            )
+        return {"etag": row[0], "gzip": row[1], "br": row[2]}
+
+    def put(self, owner, repo, sha, version, variant, entry):
+        size = len(entry["gzip"]) + len(entry["br"] or b"")
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO payloads (owner, repo, sha, version, variant, etag, gzip, br, size, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (owner, repo, sha, version, str(variant), entry["etag"], entry["gzip"], entry["br"], size, time.time()),
+            )
+        self._grew("payloads", ("owner", "repo", "sha", "version", "variant"), size)
+
+    def delete_repo(self, owner, repo):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM payloads WHERE owner=? AND repo=?", (owner, repo))
@@ -1,4 +1,9 @@
-export function createOrUpdateChart(data) {
+// Dotted name of a packed node from the root down, e.g. "requests.sessions.Session"
+const qualifiedName = d => d.ancestors().reverse().slice(1).map(a => a.data.name).join('.');
+
+// onExpand(path) is called when a container the server cut off is clicked; focusPath is
+// the container to zoom straight to, for redraws after one was expanded
+export function createOrUpdateChart(data, { onExpand, focusPath } = {}) {
     const width = 425;
     const height = 425;
 
@@ -19,7 +24,9 @@ export function createOrUpdateChart(data) {
         .size([width, height])
         .padding(3)
         (d3.hierarchy(data)
-        .sum(d => d.children ? 0 : 1)
+        // Methods and functions are sized by cyclomatic complexity, everything else counts
+        // once; containers not loaded yet by the weight of what they hold
+        .sum(d => d.truncated ? d.weight : d.children ? 0 : (d.complexity || 1))
         .sort((a, b) => b.value - a.value));
 
    const svg = chartDiv.append("svg")
@@ -35,7 +42,7 @@ export function createOrUpdateChart(data) {
 
         node.append("circle")
     .attr("fill", d => {
-        if (d.data.type === "method") {
+        if (d.data.type === "method" || d.data.type === "function") {
             return "white";
         } else if (d.data.type === "attribute") {
             return "#FFC0CB";
@@ -47,6 +54,9 @@ export function createOrUpdateChart(data) {
     .on("mouseover", function() { d3.select(this).attr("stroke", "#FF0000"); })
     .on("mouseout", function() { d3.select(this).attr("stroke", null); })
     .on("click", (event, d) => {
+        if (d.data.truncated && onExpand) {
+            onExpand(qualifiedName(d));
+        }
         focus !== d && (zoom(event, d), event.stopPropagation());
         d3.select(this.parentNode).select("text").style("display", "block");
     });
@@ -69,7 +79,13 @@ export function createOrUpdateChart(data) {
 
 
     node.on("mouseover", (event, d) => {
-    const text = d.data.name; 
+    let text = d.data.name;
+    if (d.data.complexity !== undefined) {
+        text = `${d.data.name} (complexity ${d.data.complexity}, depth ${d.data.depth}, ${d.data.statements} statements)`;
+    } else if (d.data.truncated) {
+        const counts = Object.entries(d.data.counts).map(([type, count]) => `${count} ${type}`).join(', ');
+        text = `${d.data.name} (${counts})`;
+    }
     createOrUpdateNumberDisplay(d3.select("body"), "Member name", text); 
     });
 
@@ -82,6 +98,10 @@ export function createOrUpdateChart(data) {
     svg.on("click", (event) => zoom(event, pack(data)));
     let focus = pack(data);
     let view;
+    const focused = focusPath && node.data().find(d => qualifiedName(d) === focusPath);
+    if (focused) {
+        focus = focused;
+    }
     zoomTo([focus.x, focus.y, focus.r * 2]);
 
     function zoomTo(v) {
@@ -0,0 +1,150 @@
+import os
+import struct
+from array import array
+from datetime import datetime
+
+from cache import CACHE_DIR
+
+INDEX_DIR = os.path.join(CACHE_DIR, "index")
+INDEX_MAGIC = b"CBIX1\0"
+
+
+# Maps commit ordinals to sha, author date, first parent and message. Ordinal 1 is the
+# newest commit, matching GitHub's /commits?per_page=1&page=N, so the slider's commit
+# numbers resolve with a local array lookup instead of an API round-trip.
+class CommitIndex:
+    def __init__(self, shas, dates, parents, message_offsets, messages):
+        self.shas = shas                         # 20 raw bytes per commit
+        self.dates = dates                       # array('q') of author timestamps
+        self.parents = parents                   # array('i') of first-parent ordinals, 0 for roots
+        self.message_offsets = message_offsets   # array('Q'), len(self) + 1 offsets into messages
+        self.messages = messages                 # utf-8 commit messages, concatenated
+        self._ordinals = None
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _position(self, commit_number):
+        commit_number = int(commit_number)
+        if 1 <= commit_number <= len(self):
+            return commit_number - 1
+        return None
+
+    def sha(self, commit_number):
+        position = self._position(commit_number)
+        if position is None:
+            return None
+        return self.shas[position * 20:(position + 1) * 20].hex()
+
+    def date(self, commit_number):
+        position = self._position(commit_number)
+        return None if position is None else self.dates[position]
+
+    def parent(self, commit_number):
+        position = self._position(commit_number)
+        return None if position is None else self.parents[position]
+
+    def message(self, commit_number):
+        position = self._position(commit_number)
+        if position is None:
+            return None
+        start, end = self.message_offsets[position], self.message_offsets[position + 1]
+        return self.messages[start:end].decode("utf-8", errors="replace")
+
+    def ordinal(self, sha):
+        if self._ordinals is None:
+            self._ordinals = {
+                self.shas[i * 20:(i + 1) * 20].hex(): i + 1 for i in range(len(self))
+            }
+        return self._ordinals.get(sha)
+
+    @classmethod
+    def from_commits(cls, commits):
+        # commits: (sha, author timestamp, first parent sha or None, message), newest first
+        ordinals = {sha: i + 1 for i, (sha, _, _, _) in enumerate(commits)}
+        shas = bytearray()
+        dates = array("q")
+        parents = array("i")
+        message_offsets = array("Q", [0])
+        messages = bytearray()
+        for sha, date, parent, message in commits:
+            shas += bytes.fromhex(sha)
+            dates.append(date)
+            parents.append(ordinals.get(parent, 0))
+            messages += message.encode("utf-8")
+            message_offsets.append(len(messages))
+        return cls(bytes(shas), dates, parents, message_offsets, bytes(messages))
+
+    @classmethod
+    def build_from_git(cls, repository, ref="HEAD"):
+        output = repository._git("log", "--format=%H%x00%P%x00%at%x00%B%x1e", ref)
+        commits = []
+        for record in output.split(b"\x1e"):
+            record = record.lstrip(b"\n")
+            if not record:
+                continue
+            sha, parents, date, message = record.split(b"\0", 3)
+            parents = parents.split()
+            commits.append((
+                sha.decode("ascii"),
+                int(date),
+                parents[0].decode("ascii") if parents else None,
+                message.decode("utf-8", errors="replace").rstrip("\n"),
+            ))
+        return cls.from_commits(commits)
+
+    @classmethod
+    def build_from_api(cls, owner, repo, client):
+        commits = []
+        page = 1
+        while True:
+            status_code, data = client.get_json(f"repos/{owner}/{repo}/commits", {"per_page": 100, "page": page})
+            if status_code != 200:
+                print(f"Failed to build commit index. Status code: {status_code}")
+                return None
+            if not data:
+                break
+            for item in data:
+                date = datetime.fromisoformat(item["commit"]["author"]["date"].replace("Z", "+00:00"))
+                parents = item.get("parents") or []
+                commits.append((
+                    item["sha"],
+                    int(date.timestamp()),
+                    parents[0]["sha"] if parents else None,
+                    item["commit"]["message"],
+                ))
+            page += 1
+        return cls.from_commits(commits)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack("<I", len(self)))
+            f.write(self.shas)
+            self.dates.tofile(f)
+            self.parents.tofile(f)
+            self.message_offsets.tofile(f)
+            f.write(self.messages)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            count = struct.unpack("<I", f.read(4))[0]
+            shas = f.read(count * 20)
+            dates = array("q")
+            dates.fromfile(f, count)
+            parents = array("i")
+            parents.fromfile(f, count)
+            message_offsets = array("Q")
+            message_offsets.fromfile(f, count + 1)
+            messages = f.read()
+        return cls(shas, dates, parents, message_offsets, messages)
+
+
+def index_path(owner, repo):
+    return os.path.join(INDEX_DIR, owner, repo + ".idx")
@@ -1,8 +1,8 @@
-export function createOrUpdateDashboard(data) {
+export function createOrUpdateDashboard(data, commitCount) {
     var { lines_of_code, num_classes, num_methods, num_variables, commit_message, title, commit_number } = data;
 
     const container = d3.select('#dashboard-container');
-    commit_number = 6270 - commit_number + 1;
+    commit_number = commitCount - commit_number + 1;
 
     createOrUpdateNumberDisplay(container, 'Github Repository', title);
     createOrUpdateNumberDisplay(container, 'Commit Number', commit_number);
@@ -0,0 +1,115 @@
+import os
+import shutil
+import subprocess
+
+from cache import CACHE_DIR
+from singleflight import file_lock
+
+REPOS_DIR = os.environ.get("CODEBLUEPRINT_REPOS_DIR", os.path.join(CACHE_DIR, "repos"))
+GIT_URL_TEMPLATE = os.environ.get("CODEBLUEPRINT_GIT_URL", "https://github.com/{owner}/{repo}.git")
+
+
+class GitError(Exception):
+    pass
+
+
+# A bare clone read directly from the object store: nothing is ever checked out,
+# file contents for any commit come from `git ls-tree` and `git cat-file --batch`.
+class GitRepository:
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def open(cls, owner, repo, repos_dir=REPOS_DIR, clone=True):
+        path = os.path.join(repos_dir, owner, repo + ".git")
+        if os.path.isdir(path):
+            return cls(path)
+        if not clone:
+            return None
+        with file_lock(path + ".lock"):
+            # Another thread or worker may have cloned it while we waited
+            if os.path.isdir(path):
+                return cls(path)
+            url = GIT_URL_TEMPLATE.format(owner=owner, repo=repo)
+            # Clone next to the final path and rename, so a half-finished clone is never picked up
+            partial = path + ".partial"
+            shutil.rmtree(partial, ignore_errors=True)
+            result = subprocess.run(
+                ["git", "clone", "--bare", "--quiet", url, partial],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            if result.returncode != 0:
+                print(f"Failed to clone {url}: {result.stderr.decode(errors='replace').strip()}")
+                shutil.rmtree(partial, ignore_errors=True)
+                return None
+            os.rename(partial, path)
+        return cls(path)
+
+    def _git(self, *args, input=None):
+        result = subprocess.run(
+            ["git", "--git-dir", self.path] + list(args),
+            input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            raise GitError(f"git {args[0]} failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+    def fetch(self):
+        try:
+            with file_lock(self.path + ".lock"):
+                self._git("fetch", "--quiet", "--prune", "origin", "+refs/heads/*:refs/heads/*")
+            return True
+        except GitError as e:
+            print(e)
+            return False
+
+    def has_commit(self, sha):
+        try:
+            self._git("cat-file", "-e", f"{sha}^{{commit}}")
+            return True
+        except GitError:
+            return False
+
+    # Make sure sha is in the object store, fetching once from origin if it isn't
+    def ensure_commit(self, sha):
+        return self.has_commit(sha) or (self.fetch() and self.has_commit(sha))
+
+    def commit_message(self, sha):
+        return self._git("log", "-1", "--format=%B", sha).decode("utf-8", errors="replace").rstrip("\n")
+
+    # (path, blob sha) for every regular file in the commit's tree ending with suffix
+    def list_files(self, sha, suffix=".py"):
+        entries = []
+        output = self._git("ls-tree", "-r", "-z", "--full-tree", sha)
+        for record in output.split(b"\0"):
+            if not record:
+                continue
+            meta, path = record.split(b"\t", 1)
+            mode, kind, blob = meta.split(b" ")
+            path = path.decode("utf-8", errors="replace")
+            # Skip submodules and symlinks
+            if kind != b"blob" or mode == b"120000":
+                continue
+            if path.endswith(suffix):
+                entries.append((path, blob.decode("ascii")))
+        return entries
+
+    # Raw contents for a batch of blob shas with a single `git cat-file --batch` call
+    def read_blobs(self, blob_shas):
+        blob_shas = list(dict.fromkeys(blob_shas))
+        if not blob_shas:
+            return {}
+        output = self._git("cat-file", "--batch", input=("\n".join(blob_shas) + "\n").encode("ascii"))
+        blobs = {}
+        offset = 0
+        for sha in blob_shas:
+            header_end = output.index(b"\n", offset)
+            header = output[offset:header_end].split(b" ")
+            if header[-1] == b"missing":
+                raise GitError(f"blob {sha} missing from {self.path}")
+            size = int(header[2])
+            start = header_end + 1
+            blobs[sha] = output[start:start + size]
+            # Contents are followed by a newline
+            offset = start + size + 1
+        return blobs
@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import ResponseCache
+
+# Point at a stand-in server to run without GitHub
+GITHUB_API_URL = os.environ.get("CODEBLUEPRINT_GITHUB_API_URL", "https://api.github.com")
+GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
+POOL_SIZE = int(os.environ.get("CODEBLUEPRINT_GITHUB_POOL_SIZE", 16))
+# Seconds to wait for a connection, and for each read once connected; a stalled request
+# would otherwise hold one of the job workers forever
+CONNECT_TIMEOUT = float(os.environ.get("CODEBLUEPRINT_GITHUB_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("CODEBLUEPRINT_GITHUB_READ_TIMEOUT", 30))
+# Longest a request will queue for the rate limit to reset before giving up
+MAX_RATE_LIMIT_WAIT = int(os.environ.get("CODEBLUEPRINT_MAX_RATE_LIMIT_WAIT", 60))
+# Rate-limited responses retried after waiting for the reset
+RATE_LIMIT_RETRIES = 2
+
+# Anything addressed by a full commit sha never changes
+IMMUTABLE_PATH = re.compile(r"/repos/[^/]+/[^/]+/(commits|tarball)/[0-9a-f]{40}$")
+
+
+def is_immutable(url):
+    return IMMUTABLE_PATH.search(url.split("?", 1)[0]) is not None
+
+
+# Tracks X-RateLimit-Remaining/Reset and makes callers queue until the window resets
+# instead of spending requests that are bound to fail
+class RateLimiter:
+    def __init__(self, max_wait=MAX_RATE_LIMIT_WAIT):
+        self.max_wait = max_wait
+        self.remaining = None
+        self.reset_at = 0
+        self._condition = threading.Condition()
+
+    def update(self, response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        retry_after = response.headers.get("Retry-After")
+        with self._condition:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset_at = int(reset)
+            if retry_after is not None and response.status_code in (403, 429):
+                self.remaining = 0
+                self.reset_at = max(self.reset_at, time.time() + int(retry_after))
+            if self.remaining != 0 or time.time() >= self.reset_at:
+                self._condition.notify_all()
+
+    def is_limited(self, response):
+        if response.status_code not in (403, 429):
+            return False
+        return response.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in response.headers
+
+    # True once a request may go out, False if the reset is further away than max_wait
+    def wait(self):
+        with self._condition:
+            while self.remaining == 0 and time.time() < self.reset_at:
+                delay = self.reset_at - time.time()
+                if delay > self.max_wait:
+                    return False
+                self._condition.wait(delay + 1)
+            if self.remaining == 0:
+                # Window has reset; let requests through until headers say otherwise
+                self.remaining = None
+            return True
+
+
+# Response-like wrapper around a body stream, usable as a context manager; the body of a
+# request that never went out is empty
+class StreamResponse:
+    def __init__(self, status_code, raw, on_close=None):
+        self.status_code = status_code
+        self.raw = raw
+        self._on_close = on_close
+
+    def close(self):
+        if self._on_close:
+            self._on_close()
+            self._on_close = None
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# One keep-alive connection pool for every GitHub call in the process, a thread pool to
+# run independent calls side by side, a persistent response cache revalidated with
+# ETag/Last-Modified (never revalidated for sha-addressed URLs), and rate-limit backoff.
+class GitHubClient:
+    def __init__(self, base_url=GITHUB_API_URL, token=GITHUB_TOKEN, pool_size=POOL_SIZE,
+                 response_cache=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="github")
+        self.response_cache = response_cache or ResponseCache()
+        self.rate_limiter = RateLimiter()
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    # Send a GET once the rate limit allows it, retrying rate-limited answers after the
+    # reset. Returns None when the wait would exceed MAX_RATE_LIMIT_WAIT or GitHub can't
+    # be reached in time.
+    def _get(self, url, headers=None, stream=False):
+        for _ in range(RATE_LIMIT_RETRIES + 1):
+            if not self.rate_limiter.wait():
+                print(f"GitHub rate limit exhausted until {time.ctime(self.rate_limiter.reset_at)}")
+                return None
+            try:
+                response = self.session.get(url, headers=headers, stream=stream, timeout=self.timeout)
+            except requests.RequestException as e:
+                print(f"Failed to reach {url}: {e}")
+                return None
+            self.rate_limiter.update(response)
+            if not self.rate_limiter.is_limited(response):
+                return response
+            response.close()
+        return None
+
+    # (status code, decoded JSON or None). Answers from the response cache when the URL is
+    # immutable, on a 304, or with the last known body when rate-limited.
+    def get_json(self, path, params=None):
+        url = self.session.prepare_request(requests.Request("GET", self.url(path), params=params)).url
+        cached = self.response_cache.get(url)
+        if cached and cached["immutable"]:
+            return 200, cached["body"]
+        headers = {}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self._get(url, headers)
+        # Rate-limited or unreachable: the last known body beats an error
+        if response is None:
+            return (200, cached["body"]) if cached else (503, None)
+        if response.status_code == 304 and cached:
+            return 200, cached["body"]
+        if response.status_code != 200:
+            return response.status_code, None
+        data = response.json()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified or is_immutable(url):
+            self.response_cache.put(url, etag, last_modified, is_immutable(url), data)
+        return 200, data
+
+    # Streaming response; the caller reads (and closes) it. Bodies are never kept: a
+    # tarball by sha is only fetched when its analysis isn't cached, and the analysis is.
+    def get_stream(self, path):
+        response = self._get(self.url(path), stream=True)
+        if response is None:
+            return StreamResponse(503, open(os.devnull, "rb"))
+        return StreamResponse(response.status_code, response.raw, response.close)
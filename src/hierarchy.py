@@ -0,0 +1,51 @@
+from analyzer import method_node
+
+
+def _container(name, kind):
+    return {"name": name, "type": kind, "children": []}
+
+
+# Build the package -> module -> class -> member tree from merged attributes. Every node
+# is addressed by its qualified name, the dotted names from the root down to it
+# ("requests.sessions.Session.send"). Nested classes sit inside their enclosing class.
+def build_tree(attributes):
+    root = _container(None, None)
+    nodes = {"": root}
+
+    def node_for(qualified_name, kind):
+        node = nodes.get(qualified_name)
+        if node is None:
+            parent_name, _, name = qualified_name.rpartition(".")
+            parent = node_for(parent_name, "package")
+            # A directory next to a module of the same name merges into one node
+            if kind != "class" and parent["type"] == "module":
+                parent["type"] = "package"
+            node = nodes[qualified_name] = _container(name, kind)
+            parent["children"].append(node)
+        return node
+
+    for module, module_info in attributes["modules"].items():
+        node = node_for(module, "package" if module_info["package"] else "module")
+        if module_info["package"]:
+            node["type"] = "package"
+        for function, metrics in zip(module_info["functions"], module_info["function_metrics"]):
+            node["children"].append(method_node(function, metrics, "function"))
+
+    for qualified_name, class_info in attributes["classes"].items():
+        class_node = node_for(qualified_name, "class")
+        for method, metrics in zip(class_info["methods"], class_info["method_metrics"]):
+            class_node["children"].append(method_node(method, metrics))
+        for attribute in class_info["attributes"]:
+            class_node["children"].append({"name": attribute, "type": "attribute"})
+    return root["children"]
+
+
+# Every container in a tree by qualified name: {name: (node, parent's qualified name)}
+def containers(children, prefix=""):
+    found = {}
+    for node in children:
+        if "children" in node:
+            name = prefix + node["name"]
+            found[name] = (node, prefix[:-1])
+            found.update(containers(node["children"], name + "."))
+    return found
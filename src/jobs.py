@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+# Threads running queued jobs in each process
+JOB_WORKERS = int(os.environ.get("CODEBLUEPRINT_JOB_WORKERS", 2))
+# Workers kept free of background work, so a user's analysis never waits behind
+# speculative ones. Capped at one less than JOB_WORKERS.
+JOB_FOREGROUND_WORKERS = int(os.environ.get("CODEBLUEPRINT_JOB_FOREGROUND_WORKERS", 1))
+# Jobs waiting to start; beyond this, new work is refused until the queue drains
+JOB_QUEUE_SIZE = int(os.environ.get("CODEBLUEPRINT_JOB_QUEUE_SIZE", 64))
+# Finished jobs remembered for status lookups
+JOB_HISTORY = 1024
+
+# Lower runs first
+FOREGROUND = 0
+BACKGROUND = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, fn, priority):
+        self.id = job_id
+        self.fn = fn
+        self.priority = priority
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+    @property
+    def pending(self):
+        return self.status in (QUEUED, RUNNING)
+
+    # Block up to timeout seconds for the job to finish; True if it has
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+
+# Bounded in-process queue of slow work (cold analyses), run by a few worker threads in
+# priority order. Submitting an id that is already queued or running returns the existing
+# job, raising its priority if needed, so each piece of work runs once however many
+# requests ask for it. Request threads hand work over and return instead of blocking.
+# Background jobs only start while more than `reserved` other workers are idle.
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, history=JOB_HISTORY,
+                 reserved=JOB_FOREGROUND_WORKERS):
+        self.workers = workers
+        self.reserved = max(0, min(reserved, workers - 1))
+        self.max_queued = max_queued
+        self.history = history
+        self._heap = []
+        self._order = itertools.count()
+        self._jobs = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._threads = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"jobs-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Queue fn under job_id, or return the job already doing it. Background work makes way
+    # for foreground work when the queue is full; otherwise QueueFull is raised.
+    def submit(self, job_id, fn, priority=FOREGROUND):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.pending:
+                if priority < job.priority and job.status == QUEUED:
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._order), job))
+                    # A worker holding back from it as background work may take it now
+                    self._available.notify_all()
+                return job
+            if self._queued >= self.max_queued and not self._drop_background(priority):
+                raise QueueFull(f"{self._queued} jobs already queued")
+            job = Job(job_id, fn, priority)
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            self._queued += 1
+            heapq.heappush(self._heap, (priority, next(self._order), job))
+            self._forget_finished()
+            self._start_workers()
+            self._available.notify()
+            return job
+
+    # Cancel a job if it is still queued at background priority; work someone is waiting
+    # on in the foreground is never cancelled
+    def cancel(self, job):
+        with self._lock:
+            if job.status != QUEUED or job.priority < BACKGROUND:
+                return False
+            self._finish(job, CANCELLED)
+            return True
+
+    # Cancel the least urgent queued job to make room for one of the given priority
+    def _drop_background(self, priority):
+        queued = [job for _, _, job in self._heap if job.status == QUEUED]
+        if not queued:
+            return False
+        victim = max(queued, key=lambda job: job.priority)
+        if victim.priority < BACKGROUND or victim.priority <= priority:
+            return False
+        self._finish(victim, CANCELLED)
+        return True
+
+    def _finish(self, job, status):
+        if job.status == QUEUED:
+            self._queued -= 1
+        job.status = status
+        job.fn = None
+        job.finished.set()
+
+    def _forget_finished(self):
+        while len(self._jobs) > self.max_queued + self.history:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.pending:
+                break
+            self._jobs.popitem(last=False)
+
+    def _next(self):
+        with self._lock:
+            while True:
+                while self._heap:
+                    priority, _, job = self._heap[0]
+                    # Skip cancelled jobs and entries superseded by a priority raise
+                    if job.status != QUEUED or job.priority != priority:
+                        heapq.heappop(self._heap)
+                        continue
+                    # Leave the reserved workers idle for foreground work
+                    if priority >= BACKGROUND and self.workers - self._running - 1 < self.reserved:
+                        break
+                    heapq.heappop(self._heap)
+                    self._queued -= 1
+                    self._running += 1
+                    job.status = RUNNING
+                    return job
+                self._available.wait()
+
+    def _work(self):
+        while True:
+            job = self._next()
+            try:
+                result, status, error = job.fn(), DONE, None
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                result, status, error = None, FAILED, str(e)
+            with self._lock:
+                self._running -= 1
+                job.result = result
+                job.error = error
+                job.status = status
+                job.fn = None
+                job.finished.set()
+                # Background work held back for want of an idle worker may start now
+                self._available.notify_all()
+
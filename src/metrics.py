@@ -0,0 +1,275 @@
+import ast
+import io
+import re
+import tokenize
+
+# What a plugin measures: the decoded source, its token stream, or its syntax tree. Each
+# input is prepared at most once per file, however many plugins want it.
+TEXT = "text"
+TOKENS = "tokens"
+AST = "ast"
+# Complexity of every function and lambda in the file, as ComplexityCounter finds them
+COMPLEXITIES = "complexities"
+
+
+# A per-file metric. Values are cached per (blob, name, version), so bump version whenever
+# compute changes; other metrics and the structural analysis are unaffected.
+class Metric:
+    name = None
+    version = 1
+    input = AST
+    # How file values add up to a commit's: "sum" or "max"
+    combine = "sum"
+
+    def compute(self, source):
+        raise NotImplementedError
+
+
+PLUGINS = {}
+
+
+def register(cls):
+    PLUGINS[cls.name] = cls()
+    return cls
+
+
+# {name: version} of every registered plugin
+def plugin_versions():
+    return {name: plugin.version for name, plugin in PLUGINS.items()}
+
+
+# Statements (and statement-like parts) that are a decision point where they stand
+_BRANCH_STATEMENTS = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.Assert, ast.ExceptHandler) + (
+    (ast.match_case,) if hasattr(ast, "match_case") else ()
+)
+_BLOCKS = ("body", "handlers", "orelse", "finalbody", "cases")
+# Every conditional expression, boolean operator, comprehension and lambda has one of these
+# words in its source, so expressions on lines without any are skipped unwalked
+_DECISION_WORDS = re.compile(r"\b(?:if|and|or|for|lambda)\b")
+# Fields of each node type that can hold nodes worth walking (ctx never does), and those
+# of them a statement's own expressions are in (its nested statement lists left out)
+_CHILD_FIELDS = {}
+_EXPRESSION_FIELDS = {}
+_BLOCK_FIELDS = {}
+# Nodes with nothing below them worth walking
+_LEAVES = {ast.Name, ast.Constant} | {
+    cls for base in (ast.operator, ast.unaryop, ast.cmpop, ast.boolop, ast.expr_context)
+    for cls in base.__subclasses__()
+}
+
+
+def _child_fields(cls):
+    fields = _CHILD_FIELDS.get(cls)
+    if fields is None:
+        fields = _CHILD_FIELDS[cls] = tuple(field for field in cls._fields if field != "ctx")
+    return fields
+
+
+# The statement lists of a node type, mostly none
+def block_fields(cls):
+    fields = _BLOCK_FIELDS.get(cls)
+    if fields is None:
+        fields = _BLOCK_FIELDS[cls] = tuple(field for field in _BLOCKS if field in cls._fields)
+    return fields
+
+
+def _expression_fields(cls):
+    fields = _EXPRESSION_FIELDS.get(cls)
+    if fields is None:
+        fields = _EXPRESSION_FIELDS[cls] = tuple(field for field in _child_fields(cls) if field not in _BLOCKS)
+    return fields
+
+
+# McCabe complexity of every function and lambda in a tree, in one pass over it: 1 plus
+# one per branch (if, loop, except, assert, match case, conditional expression), boolean
+# operator and comprehension loop or filter. Functions and lambdas nested in a function are
+# scored on their own, not as part of it. The analyzer's ProjectVisitor is one of these, so
+# methods are sized by the same numbers the cyclomatic_complexity plugin adds up.
+class ComplexityCounter(ast.NodeVisitor):
+    def __init__(self, text=None):
+        # Complexity of each function and lambda, in the order they end
+        self.complexities = []
+        # Running scores of the functions being walked, innermost last
+        self._scores = []
+        # How many of the source lines up to each line number hold a decision word;
+        # None walks everything
+        self._marked = None
+        if text is not None:
+            search = _DECISION_WORDS.search
+            self._marked = marked = [0]
+            count = 0
+            for line in text.split("\n"):
+                # Cheap substring tests first ("or" stands in for "for" too)
+                if ("if" in line or "or" in line or "and" in line or "lambda" in line) and search(line):
+                    count += 1
+                marked.append(count)
+
+    def visit_FunctionDef(self, node):
+        self._open_function(node)
+        self.generic_visit(node)
+        self._close_function()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def generic_visit(self, node):
+        for field in block_fields(type(node)):
+            for child in getattr(node, field):
+                self._count(child)
+                self.visit(child)
+
+    # Start scoring a function; its decorators, defaults and annotations count toward it
+    def _open_function(self, node):
+        self._scores.append([1])
+        self._count_fields(node, self._scores[-1])
+
+    def _close_function(self):
+        score = self._scores.pop()[0]
+        self.complexities.append(score)
+        return score
+
+    # Decisions a statement (or except handler, or match case) adds to the function it is
+    # in, leaving its nested statements to be counted as the traversal reaches them
+    def _count(self, node):
+        cls = type(node)
+        if cls is ast.FunctionDef or cls is ast.AsyncFunctionDef:
+            return
+        score = self._scores[-1] if self._scores else None
+        if score is not None and isinstance(node, _BRANCH_STATEMENTS):
+            score[0] += 1
+        if self._may_decide(node):
+            self._count_fields(node, score)
+
+    def _count_fields(self, node, score):
+        for field in _expression_fields(type(node)):
+            value = getattr(node, field, None)
+            if type(value) is list:
+                for item in value:
+                    if isinstance(item, ast.AST) and self._may_decide(item):
+                        self._walk(item, score)
+            elif isinstance(value, ast.AST) and self._may_decide(value):
+                self._walk(value, score)
+
+    def _may_decide(self, node):
+        marked = self._marked
+        end = getattr(node, "end_lineno", None)
+        return marked is None or end is None or marked[end] > marked[node.lineno - 1]
+
+    # Decisions in an expression; lambdas in it are scored as functions of their own
+    def _walk(self, node, score):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            cls = type(node)
+            if cls is ast.Lambda:
+                self._scores.append([1])
+                self._walk(node.args, self._scores[-1])
+                self._walk(node.body, self._scores[-1])
+                self._close_function()
+                continue
+            if score is not None:
+                if cls is ast.IfExp:
+                    score[0] += 1
+                elif cls is ast.BoolOp:
+                    score[0] += len(node.values) - 1
+                elif cls is ast.comprehension:
+                    score[0] += 1 + len(node.ifs)
+            for field in _child_fields(cls):
+                value = getattr(node, field, None)
+                if type(value) is list:
+                    for item in value:
+                        if isinstance(item, ast.AST) and type(item) not in _LEAVES:
+                            stack.append(item)
+                elif isinstance(value, ast.AST) and type(value) not in _LEAVES:
+                    stack.append(value)
+
+
+# Complexity summed over every function and lambda in the file. Reads the numbers the
+# analyzer's pass already produced when there is one (see compute_metrics).
+@register
+class CyclomaticComplexity(Metric):
+    name = "cyclomatic_complexity"
+    input = COMPLEXITIES
+
+    def compute(self, complexities):
+        return sum(complexities)
+
+
+# Lines spanned by the longest function or method
+@register
+class MaxFunctionLength(Metric):
+    name = "max_function_length"
+    combine = "max"
+
+    def compute(self, tree):
+        return max(
+            (node.end_lineno - node.lineno + 1 for node in ast.walk(tree)
+             if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))),
+            default=0,
+        )
+
+
+# import and from ... import statements, wherever they appear
+@register
+class ImportCount(Metric):
+    name = "import_count"
+    input = TOKENS
+
+    def compute(self, tokens):
+        return sum(1 for token in tokens if token.type == tokenize.NAME and token.string == "import")
+
+
+# Lines holding nothing but a comment
+@register
+class CommentLines(Metric):
+    name = "comment_lines"
+    input = TEXT
+
+    def compute(self, text):
+        return sum(1 for line in text.splitlines() if line.lstrip().startswith("#"))
+
+
+# {name: value} for the named plugins over one file. tree and complexities are reused when
+# the caller has already parsed the file and counted it. Metrics whose input can't be
+# prepared (a syntax error) are None.
+def compute_metrics(data, names, tree=None, complexities=None):
+    text = data.decode("utf-8", errors="replace") if isinstance(data, bytes) else data
+    plugins = [PLUGINS[name] for name in names if name in PLUGINS]
+    inputs = {TEXT: text}
+    if any(plugin.input == TOKENS for plugin in plugins):
+        try:
+            inputs[TOKENS] = list(tokenize.generate_tokens(io.StringIO(text).readline))
+        except (tokenize.TokenError, SyntaxError):
+            inputs[TOKENS] = None
+    needs_complexities = complexities is None and any(plugin.input == COMPLEXITIES for plugin in plugins)
+    if any(plugin.input == AST for plugin in plugins) or needs_complexities:
+        if tree is None:
+            try:
+                tree = ast.parse(text)
+            except (SyntaxError, ValueError):
+                pass
+        inputs[AST] = tree
+        if needs_complexities and tree is not None:
+            counter = ComplexityCounter("".join(io.StringIO(text, newline=None).readlines()))
+            counter.visit(tree)
+            complexities = counter.complexities
+    inputs[COMPLEXITIES] = complexities
+    values = {}
+    for plugin in plugins:
+        source = inputs[plugin.input]
+        values[plugin.name] = plugin.compute(source) if source is not None else None
+    return values
+
+
+# Worker-side entry point for the parse pool: (data, names) -> {name: value}
+def measure(job):
+    data, names = job
+    return compute_metrics(data, names)
+
+
+# A commit's value per plugin from the values of its files (one per path)
+def combine_metrics(file_metrics):
+    totals = {}
+    for name, plugin in PLUGINS.items():
+        values = [metrics[name] for metrics in file_metrics if metrics.get(name) is not None]
+        totals[name] = max(values, default=0) if plugin.combine == "max" else sum(values)
+    return totals
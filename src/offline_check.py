@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import git_backend
+from analyzer import analyze_source
+from cache import ResponseCache
+from commit_index import CommitIndex
+from git_backend import GitRepository
+from github_client import GitHubClient
+from symbols import SymbolTable
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+
+
+# Exercises the git backend, the commit index, the symbol table and the GitHub client
+# without the network: a throwaway origin repository cloned bare, and http.server standing
+# in for the API. Run it after touching git_backend.py, commit_index.py, symbols.py or
+# github_client.py.
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def __call__(self, label, condition):
+        print(f"  {'ok  ' if condition else 'FAIL'} {label}")
+        if not condition:
+            self.failures += 1
+
+
+def git(cwd, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME="check", GIT_AUTHOR_EMAIL="check@example.com",
+               GIT_COMMITTER_NAME="check", GIT_COMMITTER_EMAIL="check@example.com")
+    return subprocess.run(["git"] + list(args), cwd=cwd, env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode().strip()
+
+
+def commit_file(origin, path, text, message):
+    full_path = os.path.join(origin, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(text)
+    git(origin, "add", path)
+    git(origin, "commit", "--quiet", "-m", message)
+    return git(origin, "rev-parse", "HEAD")
+
+
+def check_git(check, work):
+    print("git backend and commit index")
+    origin = os.path.join(work, "origin")
+    os.makedirs(origin)
+    git(origin, "init", "--quiet")
+    first = commit_file(origin, "pkg/a.py", "class A:\n    pass\n", "first")
+    second = commit_file(origin, "pkg/b.py", "class B(A):\n    pass\n", "second\n\nwith a body")
+
+    git_backend.GIT_URL_TEMPLATE = origin
+    repos_dir = os.path.join(work, "repos")
+    repository = GitRepository.open("owner", "repo", repos_dir=repos_dir)
+    check("bare clone", repository is not None and os.path.isdir(repository.path))
+    check("open without clone finds it", GitRepository.open("owner", "repo", repos_dir=repos_dir, clone=False) is not None)
+    check("no clone when asked not to", GitRepository.open("owner", "other", repos_dir=repos_dir, clone=False) is None)
+
+    files = dict(repository.list_files(second))
+    check("list_files", sorted(files) == ["pkg/a.py", "pkg/b.py"])
+    blobs = repository.read_blobs(files.values())
+    check("read_blobs", blobs[files["pkg/b.py"]] == b"class B(A):\n    pass\n")
+    check("commit_message", repository.commit_message(second) == "second\n\nwith a body")
+
+    third = commit_file(origin, "pkg/c.py", "X = 1\n", "third")
+    check("new commit missing before fetch", not repository.has_commit(third))
+    check("ensure_commit fetches it", repository.ensure_commit(third))
+    check("unknown commit", not repository.ensure_commit(SHA))
+
+    index = CommitIndex.build_from_git(repository)
+    check("index newest first", [index.sha(n) for n in (1, 2, 3)] == [third, second, first])
+    check("index parents", [index.parent(n) for n in (1, 2, 3)] == [2, 3, 0])
+    check("index ordinal", index.ordinal(second) == 2 and index.ordinal(SHA) is None)
+    check("index out of range", index.sha(0) is None and index.sha(4) is None)
+    path = os.path.join(work, "index", "owner", "repo.idx")
+    index.save(path)
+    loaded = CommitIndex.load(path)
+    check("index round-trip", loaded is not None and len(loaded) == 3
+          and loaded.message(2) == "second\n\nwith a body" and list(loaded.dates) == list(index.dates))
+
+
+def check_symbols(check):
+    print("symbol table updates")
+    blobs = {}
+
+    def entries(files):
+        listed = []
+        for path, text in files.items():
+            sha = hashlib.sha1(text.encode()).hexdigest()
+            blobs[sha] = text
+            listed.append((path, sha))
+        return listed
+
+    def load(shas):
+        return {sha: analyze_source(blobs[sha]) for sha in shas}
+
+    def fresh(files):
+        return SymbolTable().inheritance(entries(files), load)
+
+    base = "class Base:\n    pass\n"
+    plain = {"pkg/base.py": base, "pkg/a.py": "class A:\n    pass\n\n\nclass Gone:\n    pass\n"}
+    derived = {"pkg/base.py": base, "pkg/a.py": "from pkg.base import Base\n\n\nclass A(Base):\n    pass\n"}
+    table = SymbolTable()
+    graph = table.inheritance(entries(plain), load)
+    check("no bases", graph == {"pkg.base.Base": [], "pkg.a.A": [], "pkg.a.Gone": []})
+    graph = table.inheritance(entries(derived), load)
+    check("base added to a class that had none", graph.get("pkg.a.A") == ["pkg.base.Base"])
+    check("removed class is gone", "pkg.a.Gone" not in graph)
+    check("and forgotten", "pkg.a.Gone" not in table._resolved
+          and not any("pkg.a.Gone" in readers for readers in table._readers.values()))
+    check("same as a fresh table", graph == fresh(derived))
+    graph = table.inheritance(entries(plain), load)
+    check("base taken away again", graph == fresh(plain) and graph["pkg.a.A"] == [])
+
+
+# Stand-in for the GitHub API: answers from `routes`, {path: (status, headers, body)},
+# honours If-None-Match against the ETag header and counts what it was asked
+class StandInHandler(BaseHTTPRequestHandler):
+    routes = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        path = self.path.split("?", 1)[0]
+        status, headers, body = self.routes.get(path, (404, {}, {"message": "Not Found"}))
+        if callable(body):
+            status, headers, body = body()
+        if status == 200 and headers.get("ETag") and self.headers.get("If-None-Match") == headers["ETag"]:
+            status, body = 304, None
+        payload = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def check_github(check, work):
+    print("GitHub client")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    routes = StandInHandler.routes
+    requests = StandInHandler.requests
+    client = GitHubClient(
+        base_url=f"http://127.0.0.1:{server.server_port}", token=None, pool_size=2,
+        response_cache=ResponseCache(os.path.join(work, "http.sqlite3")),
+    )
+    try:
+        routes["/repos/owner/repo/commits"] = (200, {"ETag": '"v1"', "X-RateLimit-Remaining": "10"}, [{"sha": SHA}])
+        check("first GET", client.get_json("repos/owner/repo/commits", {"page": 1}) == (200, [{"sha": SHA}]))
+        requests.clear()
+        check("revalidated GET", client.get_json("repos/owner/repo/commits", {"page": 1}) == (200, [{"sha": SHA}]))
+        check("sent If-None-Match and got a 304", requests == [("/repos/owner/repo/commits?page=1", '"v1"')])
+
+        routes[f"/repos/owner/repo/commits/{SHA}"] = (200, {}, {"sha": SHA})
+        client.get_json(f"repos/owner/repo/commits/{SHA}")
+        requests.clear()
+        check("sha-addressed GET from cache", client.get_json(f"repos/owner/repo/commits/{SHA}") == (200, {"sha": SHA}))
+        check("without a request", requests == [])
+
+        # Limited once with a reset a second away, then let through
+        answers = iter([
+            (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 1)}, None),
+            (200, {"X-RateLimit-Remaining": "9"}, {"ok": True}),
+        ])
+        routes["/rate_limited"] = (200, {}, lambda: next(answers))
+        began = time.time()
+        check("waits for the reset and retries", client.get_json("rate_limited") == (200, {"ok": True}))
+        check("after the reset", time.time() - began >= 0.5 and len(requests) == 2)
+
+        # A server that never answers is given up on after the read timeout
+        routes["/stalled"] = (200, {}, lambda: time.sleep(2) or (200, {}, {"late": True}))
+        client.timeout = (1, 0.5)
+        began = time.time()
+        check("stalled request times out", client.get_json("stalled") == (503, None))
+        check("within the read timeout", time.time() - began < 1.5)
+
+        # A reset further away than max_wait gives up without asking again
+        routes["/exhausted"] = (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 3600)}, None)
+        client.rate_limiter.max_wait = 1
+        requests.clear()
+        check("gives up when the reset is too far", client.get_json("exhausted") == (503, None))
+        check("with a single request", len(requests) == 1)
+        requests.clear()
+        check("stale body while limited", client.get_json("repos/owner/repo/commits", {"page": 1}) == (200, [{"sha": SHA}]))
+        check("served locally", requests == [])
+    finally:
+        server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the git backend, symbol table and GitHub client offline.")
+    parser.add_argument("--keep", action="store_true", help="leave the temporary directory behind")
+    args = parser.parse_args(argv)
+
+    check = Checks()
+    work = tempfile.mkdtemp(prefix="codeblueprint-check-")
+    try:
+        check_git(check, work)
+        check_symbols(check)
+        check_github(check, work)
+    finally:
+        if args.keep:
+            print(f"kept {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    print("all checks passed" if not check.failures else f"{check.failures} check(s) failed")
+    raise SystemExit(1 if check.failures else 0)
+
+
+if __name__ == "__main__":
+    main()
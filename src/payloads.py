@@ -0,0 +1,42 @@
+import gzip
+import hashlib
+import json
+
+try:
+    import brotli
+except ImportError:  # Optional: without it payloads are only precompressed with gzip
+    brotli = None
+
+
+# Serialize a payload once and keep it gzipped (and brotli'd when available), with a
+# strong ETag over the uncompressed JSON; see etag_for for the tag of each encoding
+def encode_payload(d3_data):
+    body = json.dumps(d3_data, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return {
+        "etag": hashlib.sha256(body).hexdigest()[:32],
+        "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+        "br": brotli.compress(body, quality=11) if brotli else None,
+    }
+
+
+# Content-Encoding of the best representation the client accepts; None for identity
+def choose_encoding(entry, accept_encodings):
+    if entry["br"] is not None and accept_encodings["br"] > 0:
+        return "br"
+    if accept_encodings["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+# Strong ETag of one representation. Each content-coding is different bytes, so each
+# gets its own tag, and a cache holding one can't revalidate another with a 304.
+def etag_for(entry, encoding):
+    return f"{entry['etag']}-{encoding}" if encoding else entry["etag"]
+
+
+# (body, Content-Encoding) for the best encoding the client accepts
+def negotiate(entry, accept_encodings):
+    encoding = choose_encoding(entry, accept_encodings)
+    if encoding is None:
+        return gzip.decompress(entry["gzip"]), None
+    return entry[encoding], encoding
@@ -0,0 +1,96 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import analyzer
+import app
+from analyzer import ANALYZER_VERSION
+
+# Commits handed to a worker at a time. Chunks are contiguous runs of history, so a
+# worker mostly hits fragments it parsed a commit earlier.
+CHUNK_SIZE = 16
+
+
+# Commits are already spread over processes here, so files within a commit stay serial
+def _init_worker():
+    analyzer.PARSE_WORKERS = 1
+
+
+# Runs in a worker process: analyze a run of commits into the shared caches
+def _analyze_chunk(owner, repo, shas):
+    analyzed = 0
+    failed = []
+    for sha in shas:
+        try:
+            if app.analyze_once(owner, repo, sha) is None:
+                failed.append((sha, "commit could not be read"))
+            else:
+                analyzed += 1
+        except Exception as e:
+            failed.append((sha, str(e)))
+    return analyzed, failed
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def precompute(owner, repo, workers=None, start=1, end=None):
+    if not app.registry.is_known(owner, repo):
+        print(f"{owner}/{repo} is not served; add it to CODEBLUEPRINT_REPOS or clone it into the repos directory.")
+        return 1
+    index = app.get_commit_index(owner, repo, wait=True)
+    if index is None:
+        print(f"Failed to build the commit index for {owner}/{repo}.")
+        return 1
+    end = min(end or len(index), len(index))
+    # Walk oldest to newest; commits finished by an earlier run are skipped, which is what
+    # makes an interrupted run resumable.
+    analyzed = app.metrics_store.get_all(owner, repo, ANALYZER_VERSION)
+    pending = []
+    for commit_number in range(end, start - 1, -1):
+        sha = index.sha(commit_number)
+        if sha not in analyzed:
+            pending.append(sha)
+    total = end - start + 1
+    done = total - len(pending)
+    print(f"Precomputing {owner}/{repo}: {len(pending)} of {total} commits left, {workers or os.cpu_count()} workers")
+    if not pending:
+        return 0
+
+    failures = []
+    began = time.time()
+    chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = [executor.submit(_analyze_chunk, owner, repo, chunk) for chunk in chunks]
+        finished = 0
+        for future in as_completed(futures):
+            analyzed, failed = future.result()
+            finished += analyzed + len(failed)
+            done += analyzed + len(failed)
+            failures.extend(failed)
+            elapsed = time.time() - began
+            rate = finished / elapsed if elapsed else 0
+            eta = (len(pending) - finished) / rate if rate else 0
+            print(f"  {done}/{total} commits, {rate:.1f} commits/s, eta {_format_duration(eta)}", flush=True)
+
+    for sha, error in failures:
+        print(f"Failed to analyze {sha}: {error}")
+    print(f"Done in {_format_duration(time.time() - began)}, {len(failures)} failed")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app precompute", description="Analyze every commit of a repository into the cache.")
+    parser.add_argument("--repo", default="psf/requests", help="owner/name of the repository (default: psf/requests)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--start", type=int, default=1, help="newest commit number to analyze (default: 1)")
+    parser.add_argument("--end", type=int, default=None, help="oldest commit number to analyze (default: the first commit)")
+    args = parser.parse_args(argv)
+    owner, _, repo = args.repo.partition("/")
+    if not owner or not repo:
+        parser.error("--repo must look like owner/name")
+    return precompute(owner, repo, args.workers, args.start, args.end)
@@ -0,0 +1,62 @@
+import os
+import threading
+
+from jobs import BACKGROUND, QueueFull
+
+# Commits on either side of the last requested one to analyze ahead of the slider; 0
+# turns prefetching off
+PREFETCH_RADIUS = int(os.environ.get("CODEBLUEPRINT_PREFETCH_RADIUS", 3))
+
+
+# Speculatively warms commits next to the one a user just asked for, so the next slider
+# step is already cached. The work runs on the shared job queue at background priority,
+# behind every analysis a user is waiting for and never on the workers the queue keeps
+# for them, and queued work that falls outside the window around the latest request is
+# cancelled when the user jumps away. Call focus after queueing the requested commit.
+class Prefetcher:
+    def __init__(self, job_queue, job_id, warm, radius=PREFETCH_RADIUS):
+        self.job_queue = job_queue
+        # job_id(owner, repo, sha) names the job; the same id a foreground request for the
+        # commit uses, so the two share one analysis
+        self.job_id = job_id
+        # warm(owner, repo, sha) analyzes and caches one commit
+        self.warm = warm
+        self.radius = radius
+        self._lock = threading.Lock()
+        self._focus = {}
+        self._pending = {}
+
+    # The user is looking at commit_number of owner/repo: queue its neighbours, nearest
+    # first and leaning in the direction the user is moving, and drop queued work for
+    # commits that are no longer near
+    def focus(self, owner, repo, index, commit_number):
+        if self.radius <= 0 or index is None:
+            return
+        with self._lock:
+            previous = self._focus.get((owner, repo))
+            self._focus[(owner, repo)] = commit_number
+            step = -1 if previous is not None and commit_number < previous else 1
+            for key, (job, ordinal) in list(self._pending.items()):
+                if not job.pending:
+                    del self._pending[key]
+                elif key[:2] == (owner, repo) and abs(ordinal - commit_number) > self.radius:
+                    self.job_queue.cancel(job)
+                    del self._pending[key]
+
+            neighbours = []
+            for distance in range(1, self.radius + 1):
+                neighbours += [commit_number + step * distance, commit_number - step * distance]
+            # Nearer commits get the more urgent of the background priorities
+            for rank, ordinal in enumerate(neighbours):
+                sha = index.sha(ordinal) if 1 <= ordinal <= len(index) else None
+                if sha is None or (owner, repo, sha) in self._pending:
+                    continue
+                try:
+                    job = self.job_queue.submit(
+                        self.job_id(owner, repo, sha),
+                        lambda sha=sha: self.warm(owner, repo, sha),
+                        BACKGROUND + rank,
+                    )
+                except QueueFull:
+                    break
+                self._pending[(owner, repo, sha)] = (job, ordinal)
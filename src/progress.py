@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Events kept per analysis for clients that subscribe after it started
+CHANNEL_MAX_EVENTS = 20000
+# Finished analyses whose events are kept around
+FINISHED_CHANNELS = 64
+
+
+class _Channel:
+    def __init__(self):
+        self.events = []
+        self.dropped = 0
+        self.finished = False
+
+
+# Progress events of running analyses, fanned out to any number of followers (the SSE
+# endpoint). Each analysis run gets a fresh channel; followers replay what it published
+# so far and then receive new events as they arrive. Only sees analyses running in this
+# process.
+class ProgressHub:
+    def __init__(self, max_events=CHANNEL_MAX_EVENTS, finished_channels=FINISHED_CHANNELS):
+        self.max_events = max_events
+        self.finished_channels = finished_channels
+        self._channels = OrderedDict()
+        self._changed = threading.Condition()
+
+    # Start a new run for key; returns progress(event, data) for the analyzer
+    def begin(self, key):
+        channel = _Channel()
+        with self._changed:
+            self._channels[key] = channel
+            self._channels.move_to_end(key)
+            finished = [k for k, c in self._channels.items() if c.finished]
+            for k in finished[:max(0, len(finished) - self.finished_channels)]:
+                del self._channels[k]
+            self._changed.notify_all()
+
+        def publish(event, data):
+            with self._changed:
+                channel.events.append((event, data))
+                # Keep the newest events; the final payload covers anything dropped
+                if len(channel.events) > self.max_events:
+                    overflow = len(channel.events) - self.max_events
+                    del channel.events[:overflow]
+                    channel.dropped += overflow
+                self._changed.notify_all()
+        return publish
+
+    def end(self, key):
+        with self._changed:
+            channel = self._channels.get(key)
+            if channel is not None:
+                channel.finished = True
+            self._changed.notify_all()
+
+    # Yield (event, data) for the current or next run of key until it ends or done() turns
+    # true. Yields None every keepalive seconds without news, so the caller can ping.
+    def follow(self, key, done, keepalive=15):
+        channel = None
+        position = 0
+        last_sent = time.time()
+        while True:
+            with self._changed:
+                current = self._channels.get(key)
+                # A run that had already finished belongs to an earlier attempt
+                if channel is None and current is not None and not current.finished:
+                    channel, position = current, current.dropped
+                pending = []
+                if channel is not None:
+                    start = max(position - channel.dropped, 0)
+                    pending = channel.events[start:]
+                    position = channel.dropped + len(channel.events)
+                ended = channel is not None and channel.finished
+                if not pending and not ended and not done():
+                    self._changed.wait(1)
+            for item in pending:
+                yield item
+            if pending:
+                last_sent = time.time()
+            if ended or (not pending and done()):
+                return
+            if time.time() - last_sent >= keepalive:
+                last_sent = time.time()
+                yield None
+
+
+# One Server-Sent Events message
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
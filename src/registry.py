@@ -0,0 +1,251 @@
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from cache import CACHE_DIR
+from commit_index import CommitIndex, index_path
+from git_backend import REPOS_DIR
+from singleflight import file_lock
+from structure_store import STRUCTURES_DIR, StructureStore
+from symbols import SymbolTable
+
+# Repositories the service answers for, as owner/repo separated by commas; "*" allows
+# any. Bare clones already present under REPOS_DIR are always served, so a repo can be
+# added offline by cloning it there.
+ALLOWED_REPOS = os.environ.get("CODEBLUEPRINT_REPOS", "psf/requests")
+# Disk shared by every repo's clone, structure store and commit index; least recently
+# used repos are deleted once the total goes over it
+REGISTRY_MAX_BYTES = int(os.environ.get("CODEBLUEPRINT_REGISTRY_MAX_BYTES", 8 * 1024 * 1024 * 1024))
+# Repos whose commit index and structure store stay loaded in process memory
+REGISTRY_MAX_OPEN = int(os.environ.get("CODEBLUEPRINT_REGISTRY_MAX_OPEN", 16))
+# Seconds before the commit index is refreshed to pick up newly pushed commits
+COMMIT_INDEX_MAX_AGE = int(os.environ.get("CODEBLUEPRINT_COMMIT_INDEX_MAX_AGE", 600))
+# Seconds before a failed index build (no clone, GitHub unreachable) is tried again
+COMMIT_INDEX_RETRY_AFTER = int(os.environ.get("CODEBLUEPRINT_COMMIT_INDEX_RETRY_AFTER", 60))
+# Seconds between disk budget checks in one process
+BUDGET_CHECK_INTERVAL = 30
+# Repos used more recently than this are never evicted, whatever the budget says
+MIN_IDLE = 600
+USAGE_DIR = os.path.join(CACHE_DIR, "registry")
+
+NAME = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+# One repo's in-memory state: its commit index, structure store and symbol table
+class RepoContext:
+    def __init__(self, owner, repo, build_index):
+        self.owner = owner
+        self.repo = repo
+        self.structure_store = StructureStore(owner, repo)
+        self.symbol_table = SymbolTable()
+        self._build_index = build_index
+        self._index = None
+        self._built_at = 0
+        self._failed_at = 0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def _backing_off(self):
+        return time.time() - self._failed_at < COMMIT_INDEX_RETRY_AFTER
+
+    # Commit index, refreshed once it is older than COMMIT_INDEX_MAX_AGE. Only a repo's
+    # very first build is waited for, and only with wait: without it None is returned
+    # until the index exists. After that the stale index keeps being served while a
+    # background thread fetches and rebuilds, so no request stalls on git or the API. A
+    # failed build is not tried again for COMMIT_INDEX_RETRY_AFTER seconds.
+    def commit_index(self, wait=True):
+        path = index_path(self.owner, self.repo)
+        with self._lock:
+            if self._index is None and os.path.exists(path):
+                self._index, self._built_at = CommitIndex.load(path), os.path.getmtime(path)
+            index = self._index
+            if index is not None:
+                stale = time.time() - self._built_at >= COMMIT_INDEX_MAX_AGE
+                if not stale or self._rebuilding or self._backing_off():
+                    return index
+                self._rebuilding = True
+        if index is not None:
+            threading.Thread(target=self._rebuild, daemon=True).start()
+            return index
+        if not wait:
+            return None
+        # Nothing to serve yet; one thread builds while the others wait for it
+        with self._build_lock:
+            with self._lock:
+                if self._index is not None or self._backing_off():
+                    return self._index
+                self._rebuilding = True
+            self._rebuild()
+            return self._index
+
+    def _rebuild(self):
+        path = index_path(self.owner, self.repo)
+        fresh = None
+        try:
+            # Another process may have just rebuilt it
+            if os.path.exists(path) and time.time() - os.path.getmtime(path) < COMMIT_INDEX_MAX_AGE:
+                fresh, built_at = CommitIndex.load(path), os.path.getmtime(path)
+            else:
+                fresh, built_at = self._build_index(self.owner, self.repo), time.time()
+                if fresh is not None:
+                    fresh.save(path)
+        except Exception as e:
+            print(f"Failed to build the commit index of {self.owner}/{self.repo}: {e}")
+            fresh = None
+        finally:
+            with self._lock:
+                if fresh is not None:
+                    self._index, self._built_at = fresh, built_at
+                else:
+                    self._failed_at = time.time()
+                self._rebuilding = False
+
+
+# Every repository the service knows about. Keeps at most max_open repos loaded in
+# memory and keeps their files on disk under max_bytes, evicting the least recently
+# used repo first. Last use is the mtime of a marker file, so every process sees it.
+class RepoRegistry:
+    def __init__(self, build_index, caches=(), allowed=ALLOWED_REPOS, repos_dir=REPOS_DIR,
+                 max_bytes=REGISTRY_MAX_BYTES, max_open=REGISTRY_MAX_OPEN):
+        self.build_index = build_index
+        # Shared caches with a delete_repo(owner, repo) method, purged with the repo
+        self.caches = caches
+        self.allowed = {name.strip() for name in allowed.split(",") if name.strip()}
+        self.repos_dir = repos_dir
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._touched = {}
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _clone_path(self, owner, repo):
+        return os.path.join(self.repos_dir, owner, repo + ".git")
+
+    def _usage_path(self, owner, repo):
+        return os.path.join(USAGE_DIR, owner, repo)
+
+    def is_allowed(self, owner, repo):
+        return "*" in self.allowed or f"{owner}/{repo}" in self.allowed
+
+    def is_known(self, owner, repo):
+        if not NAME.fullmatch(owner) or not NAME.fullmatch(repo) or "." in (owner[0], repo[0]):
+            return False
+        return self.is_allowed(owner, repo) or os.path.isdir(self._clone_path(owner, repo))
+
+    # (owner, repo) for every allowed repo plus every local clone
+    def known(self):
+        names = {tuple(name.split("/", 1)) for name in self.allowed if "/" in name}
+        if os.path.isdir(self.repos_dir):
+            for owner in os.listdir(self.repos_dir):
+                if not os.path.isdir(os.path.join(self.repos_dir, owner)):
+                    continue
+                for name in os.listdir(os.path.join(self.repos_dir, owner)):
+                    if name.endswith(".git") and os.path.isdir(os.path.join(self.repos_dir, owner, name)):
+                        names.add((owner, name[:-len(".git")]))
+        return sorted(names)
+
+    # The repo's context, loading it if needed. None for repos the service doesn't serve.
+    def get(self, owner, repo):
+        if not self.is_known(owner, repo):
+            return None
+        key = (owner, repo)
+        with self._lock:
+            context = self._open.get(key)
+            if context is None:
+                context = self._open[key] = RepoContext(owner, repo, self.build_index)
+            self._open.move_to_end(key)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        self._touch(owner, repo)
+        return context
+
+    def commit_index(self, owner, repo, wait=True):
+        context = self.get(owner, repo)
+        return context.commit_index(wait) if context is not None else None
+
+    def structure_store(self, owner, repo):
+        context = self.get(owner, repo)
+        return context.structure_store if context is not None else None
+
+    def symbol_table(self, owner, repo):
+        context = self.get(owner, repo)
+        return context.symbol_table if context is not None else None
+
+    # Record a use at most once a minute per process; mtime resolution is plenty for LRU
+    def _touch(self, owner, repo):
+        now = time.time()
+        if now - self._touched.get((owner, repo), 0) < 60:
+            return
+        self._touched[(owner, repo)] = now
+        path = self._usage_path(owner, repo)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a"):
+            os.utime(path)
+
+    # Files the registry may delete for a repo. A clone that was placed by hand for a repo
+    # that isn't allowed can't be cloned again, so it is never counted or deleted.
+    def _evictable_paths(self, owner, repo):
+        paths = [os.path.join(STRUCTURES_DIR, owner, repo), index_path(owner, repo)]
+        if self.is_allowed(owner, repo):
+            paths.append(self._clone_path(owner, repo))
+        return paths
+
+    def disk_usage(self, owner, repo):
+        return sum(_tree_size(path) for path in self._evictable_paths(owner, repo) if os.path.exists(path))
+
+    # Delete least recently used repos until the total is back under max_bytes. The repo
+    # being worked on (keep) and repos used in the last MIN_IDLE seconds are never
+    # evicted. Checked at most every BUDGET_CHECK_INTERVAL.
+    def enforce_budget(self, keep=None, force=False):
+        if not force and time.time() - self._checked_at < BUDGET_CHECK_INTERVAL:
+            return
+        self._checked_at = time.time()
+        with file_lock(os.path.join(USAGE_DIR, ".lock")):
+            repos = []
+            for owner, repo in self.known():
+                usage = self._usage_path(owner, repo)
+                last_used = os.path.getmtime(usage) if os.path.exists(usage) else 0
+                repos.append((last_used, owner, repo, self.disk_usage(owner, repo)))
+            excess = sum(size for *_, size in repos) - self.max_bytes
+            for last_used, owner, repo, size in sorted(repos):
+                if excess <= 0:
+                    break
+                if (owner, repo) == keep or size == 0 or time.time() - last_used < MIN_IDLE:
+                    continue
+                print(f"Evicting {owner}/{repo} ({size / 1024 / 1024:.0f} MiB, last used {time.ctime(last_used)})")
+                self.evict(owner, repo)
+                excess -= size
+
+    # Drop everything held for a repo. Its name stays allowed; it is rebuilt on next use.
+    def evict(self, owner, repo):
+        with self._lock:
+            self._open.pop((owner, repo), None)
+            self._touched.pop((owner, repo), None)
+        clone = self._clone_path(owner, repo)
+        # Same lock as clone and fetch, so neither sees a half-deleted clone
+        with file_lock(clone + ".lock"):
+            for path in self._evictable_paths(owner, repo) + [self._usage_path(owner, repo)]:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+        for cache in self.caches:
+            cache.delete_repo(owner, repo)
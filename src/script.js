@@ -2,13 +2,149 @@ import { debounce } from './debounce.js';
 import { createOrUpdateChart } from './chart.js';
 import { createOrUpdateDashboard } from './dashboard.js';
 
+const API_URL = 'https://gowriprashanth.pythonanywhere.com';
+// Which repository to show, from ?repo=owner/name; psf/requests by default
+const [OWNER, REPO] = (new URLSearchParams(window.location.search).get('repo') || 'psf/requests').split('/');
+// Draw cold commits as they are analyzed, over Server-Sent Events, with ?progress=stream.
+// Each open stream holds a server thread for the whole analysis, so it is only worth it
+// against a deployment running an async worker class; otherwise jobs are long-polled.
+const STREAM_PROGRESS = new URLSearchParams(window.location.search).get('progress') === 'stream' && !!window.EventSource;
+
+// Number of commits in the repository, the range of the slider
+let commitCount = null;
+// Commit the user asked for last; progress of analyses they moved away from isn't drawn
+let requestedCommit = null;
+
+// Payload currently on screen, with the subtrees fetched so far grafted in
+let currentData = null;
+
+// Levels of the tree fetched at a time; deeper ones are fetched as the user zooms in
+const LOAD_DEPTH = 2;
+
+// Fetch the levels under a container the server cut off, graft them into the payload on
+// screen and zoom to it
+function expandNode(path) {
+    const data = currentData;
+    if (!data || !data.sha) {
+        return;
+    }
+    // The versioned URL from /resolve is cacheable for good; payloads from /get_d3_data lack it
+    const url = data.structure_url || `/repos/${OWNER}/${REPO}/commits/${data.sha}/structure`;
+    axios.get(`${API_URL}${url}`, { params: { path, depth: LOAD_DEPTH } })
+        .then(response => {
+            const node = path.split('.').reduce(
+                (parent, name) => parent && parent.children.find(child => child.children && child.name === name),
+                data,
+            );
+            // The user may have moved to another commit meanwhile
+            if (!node || data !== currentData) {
+                return;
+            }
+            node.children = response.data.children;
+            delete node.truncated;
+            delete node.counts;
+            delete node.weight;
+            createOrUpdateChart(data, { onExpand: expandNode, focusPath: path });
+        })
+        .catch(error => {
+            console.error('Error expanding structure:', error);
+        });
+}
+
+// Long-poll a queued analysis until it has finished
+function waitForJob(statusUrl) {
+    return axios.get(`${API_URL}${statusUrl}`, { params: { wait: 20 } })
+        .then(response => {
+            const status = response.data.status;
+            if (status === 'queued' || status === 'running') {
+                return waitForJob(statusUrl);
+            }
+            if (status !== 'done') {
+                throw new Error(response.data.error || `Analysis ${status}`);
+            }
+        });
+}
+
+// Follow a queued analysis over Server-Sent Events, drawing its classes as they are
+// found for as long as the user is still on that commit
+function watchProgress(progressUrl, commitNumber) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`${API_URL}${progressUrl}`);
+        const partial = { title: `${REPO} by ${OWNER}`, commit_number: commitNumber, children: [] };
+        let redraw = null;
+        const draw = () => {
+            redraw = null;
+            if (commitNumber === requestedCommit) {
+                createOrUpdateChart(partial);
+                createOrUpdateDashboard(partial, commitCount);
+            }
+        };
+        const finish = () => {
+            source.close();
+            clearTimeout(redraw);
+        };
+        source.addEventListener('progress', event => {
+            const progress = JSON.parse(event.data);
+            partial.num_classes = progress.num_classes;
+            partial.num_methods = progress.num_methods;
+            partial.commit_message = `Analyzing: ${progress.files_done} of ${progress.files_total} files`;
+        });
+        source.addEventListener('classes', event => {
+            partial.children.push(...JSON.parse(event.data));
+            redraw = redraw || setTimeout(draw, 500);
+        });
+        source.addEventListener('done', () => {
+            finish();
+            resolve();
+        });
+        source.addEventListener('failed', event => {
+            finish();
+            reject(new Error(JSON.parse(event.data).error));
+        });
+        source.onerror = () => {
+            finish();
+            reject(new Error('Lost the analysis progress stream'));
+        };
+    });
+}
+
+// Cold commits answer 202 with a job to follow; once it is done, ask again
+function whenReady(request, commitNumber) {
+    return request().then(response => {
+        if (response.status !== 202) {
+            return response;
+        }
+        const ready = STREAM_PROGRESS
+            ? watchProgress(response.data.progress_url, commitNumber)
+            : waitForJob(response.data.status_url);
+        return ready.then(() => whenReady(request, commitNumber));
+    });
+}
+
+// Resolve the slider number to a sha, then fetch the top levels of the structure by sha:
+// that response never changes, so the browser and any proxy in between can cache it
+function fetchData(commitNumber) {
+    return axios.get(`${API_URL}/repos/${OWNER}/${REPO}/resolve`, { params: { commit_number: commitNumber } })
+        .then(resolved => {
+            const url = resolved.data.structure_url;
+            return whenReady(() => axios.get(`${API_URL}${url}`, { params: { depth: LOAD_DEPTH } }), commitNumber)
+                .then(response => ({ ...response.data, commit_number: commitNumber, structure_url: url }));
+        })
+        .catch(() => whenReady(() => axios.post(`${API_URL}/get_d3_data`, { owner: OWNER, repo: REPO, commit_number: commitNumber }), commitNumber)
+            .then(response => response.data));
+}
+
 // Debounced updateVisualization function
 export const UpdateVisualization = debounce(function(commitNumber) {
+    requestedCommit = commitNumber;
     // Make an AJAX call to fetch data based on the commit number from Flask endpoint
-    axios.post('https://gowriprashanth.pythonanywhere.com/get_d3_data', { commit_number: commitNumber })
-    .then(response => {
-        createOrUpdateChart(response.data);
-        createOrUpdateDashboard(response.data);
+    fetchData(commitNumber)
+    .then(data => {
+        if (!data.error) {
+            currentData = data;
+        }
+        createOrUpdateChart(data, { onExpand: expandNode });
+        createOrUpdateDashboard(data, commitCount);
     })
     .catch(error => {
         console.error('Error fetching data:', error);
@@ -16,12 +152,31 @@ export const UpdateVisualization = debounce(function(commitNumber) {
 }, 500);
 
 
-UpdateVisualization(6270);
-updateSliderValues(6270, 1);
+// Size the slider to the repository's history, then start from its first commit. A repo
+// seen for the first time answers 503 with Retry-After while its commit index is built.
+function loadRepository() {
+    axios.get(`${API_URL}/repos/${OWNER}/${REPO}`)
+        .then(response => {
+            commitCount = response.data.commit_count;
+            document.getElementById("commitNumberSlider").max = commitCount;
+            UpdateVisualization(commitCount);
+            updateSliderValues(commitCount, 1);
+        })
+        .catch(error => {
+            const response = error.response;
+            if (response && response.status === 503 && response.headers['retry-after']) {
+                setTimeout(loadRepository, Number(response.headers['retry-after']) * 1000);
+                return;
+            }
+            console.error('Error fetching repository:', error);
+        });
+}
+
+loadRepository();
 
 
 document.getElementById("commitNumberSlider").addEventListener("input", function() {
-    const sliderMax = 6270; 
+    const sliderMax = commitCount;
     const sliderValue = +document.getElementById("commitNumberSlider").value;
     
   
@@ -36,7 +191,7 @@ function updateSliderValues(max, value) {
     sliderValuesContainer.innerHTML = '';
 
 
-    const step = Math.floor(max / 10);
+    const step = Math.max(1, Math.floor(max / 10));
 
 
     for (let i = 0; i <= max; i += step) {
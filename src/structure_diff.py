@@ -0,0 +1,118 @@
+from collections import Counter
+
+from hierarchy import containers
+
+# Classes whose member sets overlap at least this much are reported as renamed
+RENAME_SIMILARITY = 0.6
+
+
+# Leaves directly in a container: a class's members, a module's functions
+def _members(node):
+    return Counter((child["name"], child["type"]) for child in node["children"] if "children" not in child)
+
+
+def _similarity(a, b):
+    union = sum((a | b).values())
+    return sum((a & b).values()) / union if union else 0.0
+
+
+# Leaf nodes by (name, type), in order; a name can appear twice (e.g. a property setter)
+def _nodes(node):
+    nodes = {}
+    for child in node["children"]:
+        if "children" not in child:
+            nodes.setdefault((child["name"], child["type"]), []).append(child)
+    return nodes
+
+
+# Members added, removed, renamed, or kept with different numbers (a method's
+# complexity). Added, renamed and updated entries carry the member's full node.
+def _member_diff(old_class, new_class):
+    old_members, new_members = _members(old_class), _members(new_class)
+    old_nodes, new_nodes = _nodes(old_class), _nodes(new_class)
+    removed = old_members - new_members
+    added = new_members - old_members
+    renamed = []
+    # A single member of a kind swapped for another of the same kind reads as a rename
+    for kind in {kind for _, kind in removed} & {kind for _, kind in added}:
+        gone = [member for member in removed.elements() if member[1] == kind]
+        new = [member for member in added.elements() if member[1] == kind]
+        if len(gone) == 1 and len(new) == 1:
+            node = {key: value for key, value in new_nodes[new[0]][0].items() if key != "name"}
+            renamed.append(dict(node, **{"from": gone[0][0], "to": new[0][0]}))
+            removed -= Counter(gone)
+            added -= Counter(new)
+
+    updated = []
+    for member in sorted(old_members & new_members, key=str):
+        for old_node, new_node in zip(old_nodes[member], new_nodes[member]):
+            if old_node != new_node:
+                updated.append(new_node)
+    return {
+        "added": [node for member in sorted(added, key=str) for node in new_nodes[member][-added[member]:]],
+        "removed": [{"name": name, "type": kind} for name, kind in sorted(removed.elements(), key=str)],
+        "renamed": sorted(renamed, key=lambda item: item["from"]),
+        "updated": updated,
+    }
+
+
+# Structural delta between two d3 payloads. Packages, modules and classes are matched by
+# qualified name: the topmost ones added (with the qualified name of the node they go
+# in) and removed, classes renamed or moved (only between containers present in both),
+# and the members and functions added, removed, renamed or re-measured inside the
+# containers present in both
+def diff_structures(old, new):
+    old_nodes = containers(old["children"])
+    new_nodes = containers(new["children"])
+    removed = [name for name in old_nodes if name not in new_nodes]
+    added = [name for name in new_nodes if name not in old_nodes]
+
+    renamed = []
+    candidates = sorted(
+        (
+            (_similarity(_members(old_nodes[a][0]), _members(new_nodes[b][0])), a, b)
+            for a in removed if old_nodes[a][0]["type"] == "class" and old_nodes[a][1] in new_nodes
+            for b in added if new_nodes[b][0]["type"] == "class" and new_nodes[b][1] in old_nodes
+        ),
+        reverse=True,
+    )
+    paired = set()
+    for score, old_name, new_name in candidates:
+        if score < RENAME_SIMILARITY:
+            break
+        if old_name in paired or new_name in paired:
+            continue
+        paired.update((old_name, new_name))
+        renamed.append({"from": old_name, "to": new_name})
+
+    # Classes nested in a renamed class move along with it
+    moved = {item["from"]: item["to"] for item in renamed}
+
+    def renamed_to(name):
+        head = name
+        while head:
+            if head in moved:
+                return moved[head] + name[len(head):]
+            head = head.rpartition(".")[0]
+        return name
+
+    old_names = {renamed_to(name): name for name in old_nodes}
+    removed = {name for name in old_nodes if renamed_to(name) not in new_nodes}
+    added = {name for name in new_nodes if name not in old_names}
+
+    changed = []
+    for new_name, (new_node, _) in new_nodes.items():
+        old_name = old_names.get(new_name)
+        if old_name is None:
+            continue
+        members = _member_diff(old_nodes[old_name][0], new_node)
+        if members["added"] or members["removed"] or members["renamed"] or members["updated"]:
+            changed.append(dict(name=new_name, **members))
+
+    return {
+        "added": [{"parent": parent, "node": node}
+                  for name, (node, parent) in new_nodes.items() if name in added and parent not in added],
+        "removed": [name for name, (_, parent) in old_nodes.items() if name in removed and parent not in removed],
+        "renamed": renamed,
+        "changed": changed,
+    }
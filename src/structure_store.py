@@ -0,0 +1,311 @@
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+
+from cache import CACHE_DIR, METRIC_COLUMNS
+from singleflight import file_lock
+
+STRUCTURES_DIR = os.path.join(CACHE_DIR, "structures")
+
+# Integer codes for node types; containers have children, the rest are leaves. New kinds
+# go at the end so stored codes keep their meaning.
+NODE_KINDS = ["class", "method", "attribute", "package", "module", "function"]
+CONTAINER_KINDS = {"class", "package", "module"}
+KIND_CODES = {kind: code for code, kind in enumerate(NODE_KINDS)}
+NO_PARENT = 0xFFFFFFFF
+# Numeric fields of method and function leaves, stored in every row (0 for other nodes)
+METHOD_METRICS = ("complexity", "statements", "depth")
+MEASURED_KINDS = {"method", "function"}
+ROW_FIELDS = 3 + len(METHOD_METRICS)
+
+# Record: the five totals, row count, message length; then the utf-8 message padded to
+# 4 bytes, then rows of (parent row, name id, kind, complexity, statements, depth) as uint32
+RECORD_HEADER = struct.Struct("<7I")
+# Index entry: raw sha, analyzer version, record offset, record length
+INDEX_ENTRY = struct.Struct("<20sIQI")
+# Commits whose tree index is kept in memory for cutting out subtrees
+TREE_INDEX_CACHE = 16
+
+
+# Subtree extents and running totals over one stored commit's rows, so a subtree or the
+# top levels of the tree can be cut out without decoding the rest. Rows are written in
+# preorder, so a node's subtree is the run of rows from just after it up to end[row], and
+# anything under it is counted as a difference of two prefix sums.
+class _TreeIndex:
+    def __init__(self, record, strings):
+        header = RECORD_HEADER.unpack_from(record)
+        self.totals = dict(zip(METRIC_COLUMNS, header[:5]))
+        row_count, message_length = header[5], header[6]
+        message_end = RECORD_HEADER.size + message_length
+        self.commit_message = bytes(record[RECORD_HEADER.size:message_end]).decode("utf-8") if message_length else None
+        rows_start = message_end + (-message_end % 4)
+        self.rows = array("I", bytes(record[rows_start:rows_start + row_count * ROW_FIELDS * 4]))
+        self.row_count = row_count
+        self.strings = strings
+
+        kinds = self.rows[2::ROW_FIELDS]
+        self.end = array("I", range(1, row_count + 1))
+        for row, parent in zip(range(row_count - 1, -1, -1), reversed(self.rows[0::ROW_FIELDS])):
+            if parent != NO_PARENT and self.end[row] > self.end[parent]:
+                self.end[parent] = self.end[row]
+        self.prefix = {
+            kind: array("I", accumulate((code == KIND_CODES[kind] for code in kinds), initial=0))
+            for kind in NODE_KINDS
+        }
+        # What the chart sizes a subtree by: each method or function's complexity, 1 per other leaf
+        leaf_weights = (
+            complexity if NODE_KINDS[code] in MEASURED_KINDS else int(NODE_KINDS[code] not in CONTAINER_KINDS)
+            for code, complexity in zip(kinds, self.rows[3::ROW_FIELDS])
+        )
+        self.weight = array("Q", accumulate(leaf_weights, initial=0))
+
+    def kind(self, row):
+        return NODE_KINDS[self.rows[row * ROW_FIELDS + 2]]
+
+    def name(self, row):
+        return self.strings[self.rows[row * ROW_FIELDS + 1]]
+
+    # Rows of the nodes directly in the run of rows [start, stop)
+    def children(self, start, stop):
+        row = start
+        while row < stop:
+            yield row
+            row = self.end[row]
+
+    # What lies in the rows [start, stop): {kind: count} and the summed weight
+    def summary(self, start, stop):
+        counts = {kind: prefix[stop] - prefix[start] for kind, prefix in self.prefix.items()}
+        return {kind: count for kind, count in counts.items() if count}, self.weight[stop] - self.weight[start]
+
+    # d3 nodes for the rows [start, stop), depth levels deep (all of them when None).
+    # Containers cut off at the last level come with truncated, counts and weight.
+    def nodes(self, start, stop, depth):
+        nodes = []
+        for row in self.children(start, stop):
+            kind = self.kind(row)
+            node = {"name": self.name(row), "type": kind}
+            if kind in CONTAINER_KINDS:
+                end = self.end[row]
+                if depth is None or depth > 1:
+                    node["children"] = self.nodes(row + 1, end, depth - 1 if depth else None)
+                else:
+                    node["children"] = []
+                    if end > row + 1:
+                        node["truncated"] = True
+                        node["counts"], node["weight"] = self.summary(row + 1, end)
+            if kind in MEASURED_KINDS:
+                offset = row * ROW_FIELDS
+                node.update(zip(METHOD_METRICS, self.rows[offset + 3:offset + ROW_FIELDS]))
+            nodes.append(node)
+        return nodes
+
+    # Row of the package, module or class at a qualified name; None if there isn't one
+    def find(self, path):
+        row, start, stop = None, 0, self.row_count
+        for name in path.split("."):
+            row = next((child for child in self.children(start, stop)
+                        if self.kind(child) in CONTAINER_KINDS and self.name(child) == name), None)
+            if row is None:
+                return None
+            start, stop = row + 1, self.end[row]
+        return row
+
+
+# Compact per-repo storage for analyzed commits. Identifiers are interned once per repo
+# in strings.txt, so a class or member name that survives thousands of commits is stored
+# once; each commit is a flat uint32 array in structures.bin, read through mmap. Files
+# are append-only and shared between processes under a file lock.
+class StructureStore:
+    def __init__(self, owner, repo, directory=None):
+        self.owner = owner
+        self.repo = repo
+        self.directory = directory or os.path.join(STRUCTURES_DIR, owner, repo)
+        self.strings_path = os.path.join(self.directory, "strings.txt")
+        self.data_path = os.path.join(self.directory, "structures.bin")
+        self.index_path = os.path.join(self.directory, "structures.idx")
+        self.lock_path = os.path.join(self.directory, ".lock")
+        self._lock = threading.Lock()
+        self._map = None
+        self._tree_indexes = OrderedDict()
+        self._reset()
+
+    def _reset(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for path in (self.strings_path, self.data_path, self.index_path):
+            open(path, "ab").close()
+        self._inode = os.stat(self.index_path).st_ino
+        self._strings = []
+        self._string_ids = {}
+        self._strings_size = 0
+        self._index = {}
+        self._index_size = 0
+        self._tree_indexes.clear()
+        if self._map is not None:
+            self._map.close()
+        self._map = None
+        self._map_size = 0
+
+    # Pick up whatever other processes appended since we last looked, starting over if
+    # the store was deleted (the repo was evicted from the registry) in the meantime
+    def _refresh(self):
+        try:
+            replaced = os.stat(self.index_path).st_ino != self._inode
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._reset()
+        size = os.path.getsize(self.strings_path)
+        if size > self._strings_size:
+            with open(self.strings_path, "rb") as f:
+                f.seek(self._strings_size)
+                chunk = f.read(size - self._strings_size)
+            # Only consume complete lines
+            chunk = chunk[:chunk.rfind(b"\n") + 1]
+            for line in chunk.splitlines():
+                self._string_ids[line.decode("utf-8")] = len(self._strings)
+                self._strings.append(line.decode("utf-8"))
+            self._strings_size += len(chunk)
+        size = os.path.getsize(self.index_path)
+        if size > self._index_size:
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_size)
+                chunk = f.read(size - self._index_size)
+            usable = len(chunk) - len(chunk) % INDEX_ENTRY.size
+            for raw_sha, version, offset, length in INDEX_ENTRY.iter_unpack(chunk[:usable]):
+                self._index[(raw_sha, version)] = (offset, length)
+            self._index_size += usable
+
+    def _mapped(self, end):
+        if self._map is None or self._map_size < end:
+            if self._map is not None:
+                self._map.close()
+            with open(self.data_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_size = len(self._map)
+        return self._map
+
+    def contains(self, sha, version):
+        with self._lock:
+            self._refresh()
+            return (bytes.fromhex(sha), version) in self._index
+
+    def get(self, sha, version):
+        with self._lock:
+            self._refresh()
+            entry = self._index.get((bytes.fromhex(sha), version))
+            if entry is None:
+                return None
+            offset, length = entry
+            record = memoryview(self._mapped(offset + length))[offset:offset + length]
+            strings = self._strings
+            header = RECORD_HEADER.unpack_from(record)
+            totals, row_count, message_length = header[:5], header[5], header[6]
+            message_end = RECORD_HEADER.size + message_length
+            rows_start = message_end + (-message_end % 4)
+            rows = record[rows_start:rows_start + row_count * ROW_FIELDS * 4].cast("I")
+
+            d3_data = dict(zip(METRIC_COLUMNS, totals))
+            d3_data["children"] = []
+            nodes = []
+            for i in range(0, row_count * ROW_FIELDS, ROW_FIELDS):
+                parent, name_id, kind = rows[i], rows[i + 1], NODE_KINDS[rows[i + 2]]
+                node = {"name": strings[name_id], "type": kind}
+                if kind in CONTAINER_KINDS:
+                    node["children"] = []
+                if kind in MEASURED_KINDS:
+                    node.update(zip(METHOD_METRICS, rows[i + 3:i + ROW_FIELDS]))
+                nodes.append(node)
+                (d3_data["children"] if parent == NO_PARENT else nodes[parent]["children"]).append(node)
+            rows.release()
+            record.release()
+            d3_data["commit_message"] = bytes(
+                self._map[offset + RECORD_HEADER.size:offset + message_end]
+            ).decode("utf-8") if message_length else None
+            d3_data["title"] = self.repo + " by " + self.owner
+            return d3_data
+
+    def _tree_index(self, sha, version):
+        key = (bytes.fromhex(sha), version)
+        tree_index = self._tree_indexes.get(key)
+        if tree_index is None:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            offset, length = entry
+            record = memoryview(self._mapped(offset + length))[offset:offset + length]
+            tree_index = self._tree_indexes[key] = _TreeIndex(record, self._strings)
+            record.release()
+            while len(self._tree_indexes) > TREE_INDEX_CACHE:
+                self._tree_indexes.popitem(last=False)
+        self._tree_indexes.move_to_end(key)
+        return tree_index
+
+    # The part of a stored commit under the package, module or class at path (the whole
+    # tree when path is empty), at most depth levels deep (all of them when depth is None),
+    # with counts and weight of everything under it. None when the commit isn't stored or
+    # nothing lives at path.
+    def select(self, sha, version, path=None, depth=None):
+        with self._lock:
+            self._refresh()
+            tree_index = self._tree_index(sha, version)
+            if tree_index is None:
+                return None
+            d3_data = dict(tree_index.totals)
+            start, stop = 0, tree_index.row_count
+            if path:
+                row = tree_index.find(path)
+                if row is None:
+                    return None
+                start, stop = row + 1, tree_index.end[row]
+                d3_data["path"] = path
+                d3_data["type"] = tree_index.kind(row)
+            d3_data["counts"], d3_data["weight"] = tree_index.summary(start, stop)
+            d3_data["children"] = tree_index.nodes(start, stop, depth)
+            d3_data["commit_message"] = tree_index.commit_message
+            d3_data["title"] = self.repo + " by " + self.owner
+            return d3_data
+
+    def put(self, sha, version, d3_data):
+        rows = array("I")
+        names = []
+
+        def add(node, parent):
+            kind = node["type"]
+            names.append(node["name"])
+            rows.extend((parent, 0, KIND_CODES[kind]))
+            rows.extend(node.get(field, 0) for field in METHOD_METRICS)
+            row = len(rows) // ROW_FIELDS - 1
+            for child in node.get("children", []):
+                add(child, row)
+
+        for child in d3_data["children"]:
+            add(child, NO_PARENT)
+
+        message = (d3_data.get("commit_message") or "").encode("utf-8")
+        with self._lock, file_lock(self.lock_path):
+            self._refresh()
+            key = (bytes.fromhex(sha), version)
+            if key in self._index:
+                return
+            new_strings = [name for name in dict.fromkeys(names) if name not in self._string_ids]
+            if new_strings:
+                with open(self.strings_path, "ab") as f:
+                    f.write("".join(name + "\n" for name in new_strings).encode("utf-8"))
+                self._refresh()
+            for i, name in enumerate(names):
+                rows[i * ROW_FIELDS + 1] = self._string_ids[name]
+
+            record = bytearray(RECORD_HEADER.pack(*(d3_data[column] for column in METRIC_COLUMNS), len(names), len(message)))
+            record += message
+            record += b"\0" * (-len(record) % 4)
+            record += rows.tobytes()
+            with open(self.data_path, "ab") as f:
+                offset = f.tell()
+                f.write(record)
+            with open(self.index_path, "ab") as f:
+                f.write(INDEX_ENTRY.pack(key[0], version, offset, len(record)))
+            self._refresh()
@@ -0,0 +1,171 @@
+import threading
+
+from analyzer import module_name
+
+
+# Names one file binds at module level, {name: dotted target}, and the modules it star
+# imports. Relative imports are made absolute against the file's package; a module's own
+# classes and functions come last and win, as they usually would at run time.
+def _file_scope(path, module, fragment):
+    package = module if path.endswith("__init__.py") else module.rpartition(".")[0]
+    scope = {}
+    stars = []
+    for name, level, imported_module, imported in fragment["imports"]:
+        if level:
+            base = package
+            for _ in range(level - 1):
+                base = base.rpartition(".")[0]
+            imported_module = ".".join(part for part in (base, imported_module) if part)
+        if imported == "*":
+            stars.append(imported_module)
+        elif imported is None:
+            scope[name] = imported_module
+        else:
+            scope[name] = f"{imported_module}.{imported}" if imported_module else imported
+    for function in fragment["functions"]:
+        scope[function] = f"{module}.{function}"
+    for class_info in fragment["classes"]:
+        if "." not in class_info["name"]:
+            scope[class_info["name"]] = f"{module}.{class_info['name']}"
+    return scope, stars
+
+
+class _Module:
+    def __init__(self):
+        self.scope = {}
+        self.stars = []
+        # {class name within the module (A or A.B): bases as written}
+        self.classes = {}
+
+
+# Project-wide symbol table of one repository, brought from one commit to the next as
+# each is asked for. Only files whose blob changed are read again, and a class's bases are only
+# resolved again when a module its resolution looked at (or looked for) changed, so
+# stepping between neighbouring commits costs about as much as their diff.
+class SymbolTable:
+    def __init__(self):
+        # path -> (blob sha, module name, scope, stars, classes)
+        self._files = {}
+        self._module_paths = {}
+        self._modules = {}
+        # qualified class name -> (resolved bases, modules the resolution consulted)
+        self._resolved = {}
+        # module name -> classes whose resolution depended on it, their own module included
+        self._readers = {}
+        self._lock = threading.Lock()
+
+    # Move the table to a commit's (path, blob sha) entries. load(shas) returns
+    # {sha: fragment} and is only called for files added or changed since the last commit.
+    def _update(self, entries, load):
+        entries = dict(entries)
+        changed = [path for path in self._files.keys() | entries.keys()
+                   if self._files.get(path, (None,))[0] != entries.get(path)]
+        fragments = load(sorted({entries[path] for path in changed if path in entries}))
+        modules = set()
+        for path in changed:
+            old = self._files.pop(path, None)
+            if old is not None:
+                modules.add(old[1])
+                self._module_paths[old[1]].discard(path)
+            if path not in entries:
+                continue
+            module = module_name(path)
+            fragment = fragments[entries[path]]
+            scope, stars = ({}, []) if fragment["syntax_error"] else _file_scope(path, module, fragment)
+            classes = {class_info["name"]: class_info["bases"] for class_info in fragment["classes"]}
+            self._files[path] = (entries[path], module, scope, stars, classes)
+            self._module_paths.setdefault(module, set()).add(path)
+            modules.add(module)
+        for module in modules:
+            self._rebuild(module)
+            for name in self._readers.pop(module, ()):
+                self._forget(name)
+
+    # Drop a class's resolution, and its place among the readers of the other modules it
+    # consulted, so classes that are gone leave nothing behind
+    def _forget(self, qualified):
+        resolved = self._resolved.pop(qualified, None)
+        if resolved is None:
+            return
+        for module in resolved[1]:
+            readers = self._readers.get(module)
+            if readers is not None:
+                readers.discard(qualified)
+                if not readers:
+                    del self._readers[module]
+
+    def _rebuild(self, module):
+        paths = sorted(self._module_paths.get(module, ()))
+        if not paths:
+            self._module_paths.pop(module, None)
+            self._modules.pop(module, None)
+            return
+        merged = _Module()
+        for path in paths:
+            _, _, scope, stars, classes = self._files[path]
+            merged.scope.update(scope)
+            merged.stars.extend(stars)
+            for name, bases in classes.items():
+                merged.classes.setdefault(name, bases)
+        self._modules[module] = merged
+
+    # Qualified name a dotted name written in module refers to; None when module binds
+    # nothing under its first part (a builtin, or a name from nowhere)
+    def _resolve(self, module, dotted, consulted, seen):
+        consulted.add(module)
+        info = self._modules.get(module)
+        if info is None or (module, dotted) in seen:
+            return None
+        seen.add((module, dotted))
+        head, _, rest = dotted.partition(".")
+        if dotted in info.classes or head in info.classes:
+            return f"{module}.{dotted}"
+        target = info.scope.get(head)
+        if target is None:
+            for star in info.stars:
+                found = self._lookup(f"{star}.{dotted}", consulted, seen, strict=True)
+                if found is not None:
+                    return found
+            return None
+        return self._lookup(target + ("." + rest if rest else ""), consulted, seen)
+
+    # Follow a qualified name through the project module it starts with, so re-exports
+    # ("from .models import Request" in a package) land on the defining module. Names
+    # outside the project are returned as they are, or None with strict.
+    def _lookup(self, qualified, consulted, seen, strict=False):
+        parts = qualified.split(".")
+        for i in range(len(parts) - 1, 0, -1):
+            module = ".".join(parts[:i])
+            consulted.add(module)
+            if module in self._modules:
+                found = self._resolve(module, ".".join(parts[i:]), consulted, seen)
+                return found if found is not None or strict else qualified
+        return None if strict else qualified
+
+    # {qualified class name: [qualified base names]} for a commit's (path, blob sha) entries,
+    # with load as for _update. Bases defined in the project are keys of the same map; the
+    # others are external (the standard library, dependencies, builtins).
+    def inheritance(self, entries, load):
+        with self._lock:
+            self._update(entries, load)
+            graph = {}
+            for module, info in self._modules.items():
+                for name, bases in info.classes.items():
+                    qualified = f"{module}.{name}"
+                    entry = self._resolved.get(qualified)
+                    if entry is None:
+                        # The class's own module changing can change its bases, even
+                        # when it has none to resolve yet
+                        consulted = {module}
+                        resolved = []
+                        for base in bases:
+                            target = self._resolve(module, base, consulted, set()) or base
+                            # A class named after the import it subclasses shadows it; the
+                            # edge can't be resolved from module-level bindings alone
+                            if target != qualified:
+                                resolved.append(target)
+                        entry = self._resolved[qualified] = resolved, consulted
+                        for consulted_module in consulted:
+                            self._readers.setdefault(consulted_module, set()).add(qualified)
+                    graph[qualified] = entry[0]
+            return graph
@@ -0,0 +1,37 @@
+from cache import METRIC_COLUMNS
+
+
+# Columnar metrics for commits start..end (commit numbers, 1 = newest), oldest first.
+# Wide ranges are cut into at most `points` buckets and each bucket is represented by its
+# newest analyzed commit; buckets with no analyzed commit come back as nulls. Metric
+# plugin totals ({sha: {name: value}}) get a column per name in plugin_names, null
+# for commits they haven't been backfilled for.
+def build_timeline(index, metrics, start, end, points, plugin_metrics=None, plugin_names=()):
+    start = max(1, start)
+    end = min(end, len(index))
+    timeline = {"commit_number": [], "sha": [], "date": []}
+    for column in METRIC_COLUMNS + tuple(plugin_names):
+        timeline[column] = []
+    if end < start:
+        return timeline
+
+    commit_numbers = list(range(end, start - 1, -1))
+    points = max(1, min(points, len(commit_numbers)))
+    for bucket in range(points):
+        first = bucket * len(commit_numbers) // points
+        last = (bucket + 1) * len(commit_numbers) // points
+        chosen, row = commit_numbers[last - 1], None
+        for commit_number in reversed(commit_numbers[first:last]):
+            row = metrics.get(index.sha(commit_number))
+            if row is not None:
+                chosen = commit_number
+                break
+        timeline["commit_number"].append(chosen)
+        timeline["sha"].append(index.sha(chosen))
+        timeline["date"].append(index.date(chosen))
+        for column, value in zip(METRIC_COLUMNS, row or (None,) * len(METRIC_COLUMNS)):
+            timeline[column].append(value)
+        plugin_row = (plugin_metrics or {}).get(index.sha(chosen), {})
+        for name in plugin_names:
+            timeline[name].append(plugin_row.get(name))
+    return timeline